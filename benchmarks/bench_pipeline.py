@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Measures the download pipeline's own overhead with spotdl replaced by
+fake_spotdl.py, so no network is involved.
+
+Every (rows, engine, workers) combination runs in a fresh child process that
+drives a spdl_core.DownloadSession on a synthetic CSV, and reports:
+
+    tracks/s      finished tracks per wall-clock second
+    peak RSS      of the coordinator process (the stub children are not included)
+    UI events     progress updates coalesced into one 100 ms UI frame (max / mean),
+                  i.e. what the UI would have had to queue without snapshots
+    stop latency  seconds from Stop to the coordinator returning, measured in a
+                  separate run that is stopped after --stop-after seconds
+
+Example:
+
+    python benchmarks/bench_pipeline.py --rows 1000,10000 --workers 4,16 --engines Threads,Asyncio
+
+With --convert-seconds the stubs also burn CPU per track, inside the spotdl stub
+when conversion is inline and in fake_ffmpeg.py when --postprocess includes "on".
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+STUB = BENCH_DIR / "fake_spotdl.py"
+FFMPEG_STUB = BENCH_DIR / "fake_ffmpeg.py"
+UI_TICK_SECONDS = 0.1
+PLAYLISTS = 50 # Synthetic rows are spread over this many playlists
+
+
+def write_csv(path: Path, rows: int):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Track name", "Artist name", "Playlist name", "Spotify - id"])
+        for i in range(rows):
+            writer.writerow([f"Track {i}", f"Artist {i % 997}", f"Playlist {i % PLAYLISTS}", ""])
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None # Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_one(config: dict) -> dict:
+    """
+    Runs one configuration in this process. Called in the child.
+    """
+    sys.path.insert(0, str(REPO_DIR))
+    import spdl_core
+
+    spdl_core.DOWNLOAD_TIMEOUT = config["timeout"]
+    spdl_core.STALL_TIMEOUT_SECONDS = config["timeout"]
+
+    work = Path(tempfile.mkdtemp(prefix="spdl-bench-"))
+    csv_path = work / "tracks.csv"
+    write_csv(csv_path, config["rows"])
+
+    app = spdl_core.DownloadSession()
+    app.engine = config["engine"]
+    app.batch_size = config["batch_size"]
+    app.postprocess = config["postprocess"]
+    app.rate_limit = config["rate"]
+    app.scheduler = config["order"]
+    app.prepare(app.load_csv(csv_path), spdl_core.count_csv_rows(csv_path))
+
+    coordinator = threading.Thread(target=app.download_coordinator,
+                                   args=(config["workers"], work / "out"), daemon=True)
+    started = time.monotonic()
+    coordinator.start()
+
+    # Sample progress the way the UI poller does
+    ticks, events, last_version = 0, [], 0
+    stop_requested = None
+    while coordinator.is_alive():
+        coordinator.join(UI_TICK_SECONDS)
+        snap = app.progress.snapshot()
+        events.append(snap["version"] - last_version)
+        last_version = snap["version"]
+        ticks += 1
+        if config["stop_after"] and stop_requested is None and time.monotonic() - started >= config["stop_after"]:
+            stop_requested = time.monotonic()
+            app.request_stop()
+    finished = time.monotonic()
+
+    snap = app.progress.snapshot()
+    elapsed = (stop_requested or finished) - started
+    return {
+        **config,
+        "completed": snap["completed"],
+        "errors": snap["errors"],
+        "seconds": round(finished - started, 2),
+        "tracks_per_second": round(snap["completed"] / elapsed, 1) if elapsed > 0 else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "ui_events_max": max(events, default=0),
+        "ui_events_mean": round(sum(events) / len(events), 1) if events else 0.0,
+        "stop_latency": round(finished - stop_requested, 3) if stop_requested else None,
+    }
+
+
+def run_child(config: dict) -> dict:
+    env = dict(os.environ)
+    env["SPDL_SPOTDL_CMD"] = str(STUB)
+    env["SPDL_FFMPEG_CMD"] = str(FFMPEG_STUB)
+    env["FAKE_SPOTDL_CONVERT_SECONDS"] = env["FAKE_FFMPEG_SECONDS"] = str(config["convert_seconds"])
+    env["SPDL_WORKER_MODULE"] = "fake_spotdl"
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(BENCH_DIR), env.get("PYTHONPATH", "")]))
+    env["FAKE_SPOTDL_LATENCY"] = str(config["latency"])
+    env["FAKE_SPOTDL_FAIL_RATE"] = str(config["fail_rate"])
+    env["FAKE_SPOTDL_TRANSIENT_RATE"] = str(config["transient_rate"])
+    env["FAKE_SPOTDL_TIMEOUT_RATE"] = str(config["timeout_rate"])
+    result = subprocess.run([sys.executable, __file__, "--child", json.dumps(config)],
+                            env=env, capture_output=True, text=True)
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines:
+        raise RuntimeError(f"Benchmark run failed: {config}\n{result.stderr[-2000:]}")
+    return json.loads(lines[-1])
+
+
+def print_row(r: dict):
+    rss = f"{r['peak_rss_mb']:.1f}" if r["peak_rss_mb"] is not None else "n/a"
+    stop = f"{r['stop_latency']:.3f}s" if r["stop_latency"] is not None else "-"
+    print(f"{r['rows']:>7} {r['engine']:<13} {'on' if r['postprocess'] else 'off':>4} {r['workers']:>4} "
+          f"{r['tracks_per_second']:>9.1f} "
+          f"{rss:>8} {r['ui_events_max']:>6} {r['ui_events_mean']:>7.1f} {stop:>9} {r['errors']:>6}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SPOTDL GUI pipeline benchmark (offline)")
+    parser.add_argument("--rows", default="1000,10000", help="Comma-separated CSV sizes, e.g. 1000,10000,100000")
+    parser.add_argument("--workers", default="4,16")
+    parser.add_argument("--engines", default="Threads,Batched,Warm workers,Asyncio")
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean stub seconds per track")
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--transient-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--rate", type=float, default=0.0, help="Rate limit in spotdl starts/s; 0 (default) = off")
+    parser.add_argument("--order", default="FIFO", help='Scheduler, e.g. "Round robin" or "Shortest playlist first"')
+    parser.add_argument("--convert-seconds", type=float, default=0.0, help="CPU seconds per track spent converting")
+    parser.add_argument("--postprocess", default="off", help='"off", "on" or "off,on": convert inline or on the CPU pool')
+    parser.add_argument("--timeout", type=float, default=10.0, help="DOWNLOAD_TIMEOUT used for the runs")
+    parser.add_argument("--stop-after", type=float, default=2.0, help="Seconds before Stop in the stop-latency run; 0 skips it")
+    parser.add_argument("--json", help="Also write all results to this file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_one(json.loads(args.child))))
+        return 0
+
+    base = {"batch_size": args.batch_size, "latency": args.latency, "fail_rate": args.fail_rate,
+            "transient_rate": args.transient_rate, "timeout_rate": args.timeout_rate, "timeout": args.timeout,
+            "convert_seconds": args.convert_seconds, "rate": args.rate,
+            "order": args.order}
+    engines = [engine.strip() for engine in args.engines.split(",")]
+    workers = [int(w) for w in args.workers.split(",")]
+    rows = [int(r) for r in args.rows.split(",")]
+    modes = [mode.strip() == "on" for mode in args.postprocess.split(",")]
+
+    print(f"{'rows':>7} {'engine':<13} {'post':>4} {'wkrs':>4} {'tracks/s':>9} {'RSS MB':>8} {'ui max':>6} "
+          f"{'ui mean':>7} {'stop':>9} {'errors':>6}")
+    results = []
+    for n in rows:
+        for engine in engines:
+            for post in modes:
+                for w in workers:
+                    result = run_child({**base, "rows": n, "engine": engine, "workers": w, "postprocess": post,
+                                        "stop_after": 0})
+                    print_row(result)
+                    results.append(result)
+    if args.stop_after:
+        for engine in engines:
+            # Long stub latency so Stop always lands on busy workers
+            result = run_child({**base, "rows": max(workers) * 8, "engine": engine, "workers": max(workers),
+                                "latency": max(args.latency, args.stop_after * 10), "postprocess": modes[-1],
+                                "stop_after": args.stop_after})
+            print_row(result)
+            results.append(result)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
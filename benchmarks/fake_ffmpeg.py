@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+"""
+Offline stand-in for ffmpeg, used by the benchmarks (point SPDL_FFMPEG_CMD at
+this file). It accepts the arguments of a post-processing transcode, keeps one
+CPU busy for FAKE_FFMPEG_SECONDS (default 0.2) and copies the input to the output.
+"""
+
+import os
+import sys
+import time
+import shutil
+
+
+def main(argv: list) -> int:
+    source = argv[argv.index("-i") + 1]
+    target = argv[-1]
+    deadline = time.process_time() + float(os.environ.get("FAKE_FFMPEG_SECONDS", 0.2))
+    while time.process_time() < deadline:
+        pass # CPU time rather than sleep, so oversubscribing the cores shows up
+    shutil.copyfile(source, target)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Offline stand-in for spotdl, used by the benchmarks.
+
+As a command (point SPDL_SPOTDL_CMD at this file) it accepts the arguments
+SpDL.py passes to ``spotdl``, sleeps, prints spotdl-like status lines and writes a
+dummy file per query in the requested ``--format``. As a module (``spdl_worker.py --module fake_spotdl`` with
+this directory on PYTHONPATH) it exposes a spotdl-compatible ``Spotdl`` class for
+the "Warm workers" engine.
+
+Behaviour is drawn per query from these environment variables:
+
+    FAKE_SPOTDL_LATENCY         mean seconds per track (lognormal), default 0.05
+    FAKE_SPOTDL_JITTER          lognormal sigma, default 0.5
+    FAKE_SPOTDL_FAIL_RATE       share of permanent failures ("No results found"), default 0
+    FAKE_SPOTDL_TRANSIENT_RATE  share of transient failures (HTTP 429), default 0
+    FAKE_SPOTDL_TIMEOUT_RATE    share of tracks that hang until killed, default 0
+    FAKE_SPOTDL_CORRUPT_RATE    share of "successful" tracks written truncated, default 0
+    FAKE_SPOTDL_SEED            makes the draws reproducible per query
+    FAKE_SPOTDL_CONVERT_SECONDS CPU seconds burnt per track unless it is fetched as
+                                native opus with --bitrate disable, default 0
+    FAKE_SPOTDL_SEARCH_SECONDS  extra seconds per track for the search, skipped for
+                                pre-resolved "source_url|spotify_url" queries, default 0
+
+With --save-file the resolved songs are written like spotdl does, with fake URLs
+that encode the query, so a cached "source_url|spotify_url" query maps back to it.
+"""
+
+import os
+import sys
+import time
+import math
+import json
+import base64
+import random
+import hashlib
+from pathlib import Path
+
+FAKE_MP3 = b"ID3\x03\x00\x00\x00\x00\x00\x00" + b"\xff\xfb\x90\x64" + bytes(413)
+
+
+def setting(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+
+def draw(query: str) -> tuple:
+    """
+    Returns (outcome, seconds) for one query: outcome is "ok", "fail",
+    "transient", "hang" or "corrupt".
+    """
+    seed = os.environ.get("FAKE_SPOTDL_SEED")
+    rng = random.Random(hashlib.blake2b(f"{seed}:{query}".encode()).digest()) if seed else random
+    mean = setting("FAKE_SPOTDL_LATENCY", 0.05)
+    sigma = setting("FAKE_SPOTDL_JITTER", 0.5)
+    seconds = rng.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma) if mean > 0 else 0.0
+
+    roll = rng.random()
+    for outcome, rate in (("hang", setting("FAKE_SPOTDL_TIMEOUT_RATE", 0)),
+                          ("fail", setting("FAKE_SPOTDL_FAIL_RATE", 0)),
+                          ("transient", setting("FAKE_SPOTDL_TRANSIENT_RATE", 0)),
+                          ("corrupt", setting("FAKE_SPOTDL_CORRUPT_RATE", 0))):
+        if roll < rate:
+            return outcome, seconds
+        roll -= rate
+    return "ok", seconds
+
+
+def resolve(query: str) -> tuple:
+    """
+    Returns (name, spotify_url, download_url) for a query. Pre-resolved queries
+    decode the name back from their fake download URL.
+    """
+    if "|" in query:
+        download_url, spotify_url = query.split("|", 1)
+        name = base64.urlsafe_b64decode(download_url.partition("v=")[2].encode()).decode()
+        return name, spotify_url, download_url
+    digest = hashlib.blake2b(query.encode(), digest_size=11).hexdigest()
+    encoded = base64.urlsafe_b64encode(query.encode()).decode()
+    return query, f"https://open.spotify.com/track/{digest}", f"https://music.youtube.com/watch?v={encoded}"
+
+
+def song_json(query: str) -> dict:
+    name, spotify_url, download_url = resolve(query)
+    artist, sep, title = name.partition(" - ")
+    return {"name": title if sep else name, "artists": [artist] if sep else [],
+            "url": spotify_url, "download_url": download_url}
+
+
+def file_name(query: str, audio_format: str = "mp3") -> str:
+    name = query.rsplit("/", 1)[-1] if query.startswith("http") else query
+    return "".join("_" if c in '/\\:*?"<>|' else c for c in name).strip() + "." + audio_format
+
+
+def fake_download(query: str, out_folder: str, say=None, audio_format: str = "mp3", native: bool = False):
+    """
+    Simulates one track. Returns (path, error); say receives status lines.
+    """
+    say = say or (lambda line: None)
+    query, cached = resolve(query)[0], "|" in query
+    outcome, seconds = draw(query)
+    say(f"{query}: Processing query")
+    if not cached:
+        time.sleep(setting("FAKE_SPOTDL_SEARCH_SECONDS", 0))
+    for pct in (25, 50, 100):
+        time.sleep(seconds / 3)
+        say(f"{query}: Downloading {pct}%")
+    if outcome == "hang":
+        while True:
+            time.sleep(60)
+    if outcome == "fail":
+        return None, f"LookupError: No results found for song: {query}"
+    if outcome == "transient":
+        return None, "HTTP Error 429: Too Many Requests"
+    if not native:
+        say(f"{query}: Converting")
+        deadline = time.process_time() + setting("FAKE_SPOTDL_CONVERT_SECONDS", 0)
+        while time.process_time() < deadline:
+            pass
+    path = Path(out_folder) / file_name(query, audio_format)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(FAKE_MP3[:len(FAKE_MP3) // 2] if outcome == "corrupt" else FAKE_MP3)
+    say(f'Downloaded "{query}": https://music.youtube.com/watch?v=fake')
+    return path, ""
+
+
+# ---- Module interface for spdl_worker.py ----
+class Song:
+    def __init__(self, query: str):
+        self.query = query
+        self.display_name, self.url, self.download_url = resolve(query)
+
+
+class Downloader:
+    def __init__(self, settings: dict):
+        self.settings = dict(settings)
+
+
+class Spotdl:
+    def __init__(self, client_id="", client_secret="", downloader_settings=None):
+        self.downloader = Downloader(downloader_settings or {})
+
+    def search(self, queries: list) -> list:
+        return [Song(query) for query in queries]
+
+    def download(self, song: Song):
+        out_folder = str(Path(self.downloader.settings.get("output", ".")).parent)
+        settings = self.downloader.settings
+        path, _ = fake_download(song.query, out_folder, audio_format=settings.get("format", "mp3"),
+                                native=settings.get("format") == "opus" and settings.get("bitrate") == "disable")
+        return song, path
+
+
+# ---- Command interface ----
+def main(argv: list) -> int:
+    queries, out_folder, audio_format, bitrate, save_file = [], ".", "mp3", None, None
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg == "--output":
+            out_folder = argv[i + 1]
+            i += 2
+        elif arg == "--format":
+            audio_format = argv[i + 1]
+            i += 2
+        elif arg == "--bitrate":
+            bitrate = argv[i + 1]
+            i += 2
+        elif arg == "--save-file":
+            save_file = argv[i + 1]
+            i += 2
+        elif arg == "--simple-tui":
+            i += 1
+        elif arg.startswith("--"):
+            i += 2
+        else:
+            queries.append(arg)
+            i += 1
+
+    def say(line: str):
+        print(line, flush=True)
+
+    failed, saved = False, []
+    for query in queries:
+        _, error = fake_download(query, out_folder, say, audio_format, audio_format == "opus" and bitrate == "disable")
+        if error:
+            print(error, file=sys.stderr, flush=True)
+            failed = True
+        else:
+            saved.append(song_json(query))
+    if save_file:
+        with open(save_file, "w", encoding="utf-8") as f:
+            json.dump(saved, f)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
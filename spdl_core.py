@@ -0,0 +1,3314 @@
+#!/usr/bin/env python3
+"""
+SPOTDL GUI — download core.
+
+Everything needed to run a download job without a window: track sources (CSV,
+Spotify links, the resume manifest), the engines that drive spotdl, retries,
+deduplication, logging and metrics, plus the headless command-line entry point.
+Nothing here imports a GUI toolkit.
+"""
+
+import os
+import re
+import sys
+import csv
+import time
+import json
+import heapq
+import random
+import shutil
+import signal
+import socket
+import hashlib
+import asyncio
+import argparse
+import tempfile
+import itertools
+import sqlite3
+import threading
+import subprocess
+import contextlib
+import multiprocessing
+import concurrent.futures
+from pathlib import Path
+from collections import deque
+from datetime import datetime
+from queue import Queue, LifoQueue, Empty
+
+# ---------------- Config ----------------
+DEFAULT_OUTPUT_FOLDER_NAME = "Spotify Downloads"
+SPOTDL_CMD = os.environ.get("SPDL_SPOTDL_CMD", "spotdl") # Point at benchmarks/fake_spotdl.py to run offline
+FFMPEG_CMD = os.environ.get("SPDL_FFMPEG_CMD", "ffmpeg")
+OUTPUT_FORMAT = "mp3"
+NATIVE_FORMAT = "opus" # What YouTube serves; fetched without re-encoding when post-processing is on
+POSTPROCESS_WORKERS = os.cpu_count() or 1 # ffmpeg transcodes running at once
+POSTPROCESS_QUEUE_SIZE = 2 * POSTPROCESS_WORKERS # Downloaded files allowed to wait for a transcode slot
+TRANSCODE_TIMEOUT = 300
+TRANSCODE_ARGS = ["-codec:a", "libmp3lame", "-q:a", "0", "-id3v2_version", "3"] # VBR ~245 kbps
+LOUDNORM_FILTER = "loudnorm=I=-14:TP=-1.5:LRA=11" # Single-pass EBU R128, streaming-service level
+VERIFY_WORKERS = os.cpu_count() or 1 # Processes checking finished files
+VERIFY_QUEUE_SIZE = 4 * VERIFY_WORKERS # Finished files allowed to wait for a check
+VERIFY_TIMEOUT = 120 # ffmpeg decode check of a non-MP3 file
+VERIFY_DURATION_TOLERANCE = 0.15 # Share of the expected length a file may be short by...
+VERIFY_DURATION_SLACK_SECONDS = 10 # ...or this many seconds, whichever is more
+VERIFY_MP3_SYNC_SEARCH_BYTES = 64 * 1024 # How far past the ID3 tag the first MP3 frame may start
+VERIFY_MP3_MAX_JUNK_BYTES = 4096 # Unparseable bytes tolerated after the last MP3 frame
+DOWNLOAD_TIMEOUT = 300
+STALL_TIMEOUT_SECONDS = 90 # A spotdl process silent for this long is treated as stuck
+OUTPUT_TAIL_LINES = 20 # Lines of spotdl output kept for error reports
+STOP_GRACE_SECONDS = 0.5 # Time children get to exit after SIGTERM before they are killed
+PARTIAL_FILE_PATTERNS = ("*.part", "*.part-Frag*", "*.ytdl", "*.temp", "*.tmp")
+RESOLVE_TIMEOUT = 900 # Expanding a large playlist/album/artist link into its tracks
+RESOLVE_WORKERS = 4 # Links resolved in parallel
+MAX_RETRIES = 1
+RETRY_AFTER_SUCCESS_COUNT = 5 # Successes needed after a failure before that track is retried
+RETRY_BASE_DELAY_SECONDS = 15
+RETRY_MAX_DELAY_SECONDS = 600
+DEFAULT_CONCURRENT_WORKERS = 10
+IN_FLIGHT_PER_WORKER = 4 # Submitted-but-unfinished tasks allowed per worker
+AUTO_CONCURRENCY_MIN = 2
+AUTO_CONCURRENCY_MAX = 64
+AUTO_CONCURRENCY_STEP = 2 # Additive increase per evaluation
+AUTO_CONCURRENCY_WINDOW_SECONDS = 120 # Sliding window for throughput / error rate
+AUTO_CONCURRENCY_INTERVAL_SECONDS = 20 # How often the limit is re-evaluated
+AUTO_CONCURRENCY_ERROR_RATE = 0.2 # Error/timeout rate that triggers a back-off
+RATE_LIMIT_PER_SECOND = 2.0 # spotdl starts per second across all workers (batches count per track); 0 = unlimited
+RATE_LIMIT_BURST = 10 # Starts allowed back to back before the rate applies
+RATE_LIMIT_PENALTY_FACTOR = 0.5 # Rate multiplier applied when spotdl reports a rate limit
+RATE_LIMIT_PENALTY_SECONDS = 60 # How long a penalty lasts; another hit extends it
+RATE_LIMIT_MIN_PER_SECOND = 0.05
+RATE_LIMIT_RECHECK_SECONDS = 1.0 # Waiting starts re-check the bucket this often, so rate changes apply to them
+DEFAULT_BATCH_SIZE = 20 # Queries handed to one spotdl process in batched mode
+ENGINES = ["Threads", "Batched", "Warm workers", "Asyncio"]
+WARM_WORKER_SCRIPT = Path(__file__).with_name("spdl_worker.py")
+WARM_WORKER_MODULE = os.environ.get("SPDL_WORKER_MODULE", "spotdl") # Swap in a fake spotdl module for tests
+WARM_WORKER_STARTUP_TIMEOUT = 120
+MANIFEST_FILE_NAME = ".spdl_manifest.sqlite"
+LEASE_DIR_NAME = ".spdl_leases" # Cross-instance claims on output files, inside the output folder
+LEASE_TTL_SECONDS = 2 * DOWNLOAD_TIMEOUT # A lease not renewed for this long is considered abandoned
+LEASE_RENEW_SECONDS = 60
+MANIFEST_COMMIT_EVERY = 200 # Results buffered before a manifest commit
+MANIFEST_COMMIT_INTERVAL_SECONDS = 5
+FAILURE_LOG_FLUSH_SECONDS = 2 # The failure log writer flushes at most this often
+FAILURE_LOG_BATCH = 500
+CSV_FIELDS = ["Track name", "Artist name", "Playlist name", "Spotify - id", "Duration (ms)"] # The columns load_csv reads
+LIBRARY_INDEX_FILE_NAME = ".spdl_library_index.json"
+QUERY_CACHE_FILE_NAME = ".spdl_query_cache.sqlite"
+QUERY_CACHE_TTL_SECONDS = 30 * 24 * 3600 # Resolved matches are searched again after this long
+QUERY_CACHE_MAX_ENTRIES = 200_000 # Least recently used entries beyond this are evicted
+AUDIO_EXTENSIONS = {".mp3", ".m4a", ".flac", ".opus", ".ogg", ".wav"}
+ETA_UPDATE_INTERVAL_SECONDS = 10 # NEW: Define the update frequency
+UI_MIN_TICK_MS = 100 # Frame budget: the UI renders at most this often
+UI_MAX_TICK_MS = 1000 # Idle back-off ceiling for the poller
+UI_MAX_ACTIVE_ROWS = 50 # Rows shown in the active downloads panel
+UI_MAX_PLAYLIST_ROWS = 30 # Rows shown in the playlists panel
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, float("inf")) # Seconds
+THROUGHPUT_WINDOW_SECONDS = 60 # Rolling window for the tracks/s figure
+METRICS_PROMETHEUS_FILE = os.environ.get("SPDL_PROMETHEUS_FILE", "") # e.g. a node_exporter textfile; empty = off
+METRICS_EXPORT_INTERVAL_SECONDS = 15
+# ----------------------------------------
+
+def sanitize_for_filesystem(name: str, replacement: str = "_") -> str:
+    if not name:
+        return "Unknown"
+    name = "".join(c if c.isprintable() else replacement for c in name.strip())
+    name = name.replace("/", replacement).replace("\\", replacement)
+    return name[:200]
+
+def format_eta(seconds: int) -> str:
+    if seconds <= 0:
+        return "N/A" # Return N/A if time is zero or negative
+
+    # Ensure seconds is an integer and non-negative
+    seconds = max(0, int(round(seconds)))
+
+    m, s = divmod(seconds, 60)
+    h, m = divmod(m, 60)
+    d, h = divmod(h, 24)
+
+    parts = []
+    if d > 0:
+        parts.append(f"{d}d")
+    if h > 0:
+        parts.append(f"{h}h")
+    if m > 0:
+        parts.append(f"{m}m")
+    if s > 0 or not parts: # Show seconds if no other unit or if time is less than 1 minute
+        parts.append(f"{s}s")
+
+    return " ".join(parts)
+
+def is_tool(name: str) -> bool:
+    return shutil.which(name) is not None
+
+class Track:
+    """
+    One download job. Slotted so multi-hundred-thousand-row exports stay compact.
+    """
+    __slots__ = ("title", "artist", "playlist", "spotify_id", "duration")
+
+    def __init__(self, title: str = "", artist: str = "", playlist: str = "Default", spotify_id: str = "",
+                 duration: float = 0.0):
+        self.title = title
+        self.artist = artist
+        self.playlist = playlist
+        self.spotify_id = spotify_id
+        self.duration = duration # Expected length in seconds, 0 = unknown
+
+    def __repr__(self):
+        return f"Track({self.artist!r} - {self.title!r} @ {self.playlist!r})"
+
+def count_csv_rows(path) -> int:
+    """
+    Fast newline count used for the progress total before the CSV is parsed.
+    Quoted fields containing newlines make this an estimate; the coordinator
+    corrects the total once the stream is exhausted.
+    """
+    lines = 0
+    last = b"\n"
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            lines += chunk.count(b"\n")
+            last = chunk[-1:]
+        f.seek(0)
+        head = f.read(4096).split(b"\n", 1)[0].lower()
+    if last != b"\n":
+        lines += 1
+    if b"track name" in head:
+        lines -= 1
+    return max(lines, 0)
+
+def parse_duration_ms(text) -> float:
+    """
+    Seconds from a milliseconds column such as Exportify's "Duration (ms)"; 0 when missing.
+    """
+    text = (text or "").strip()
+    return int(text) / 1000 if text.isdigit() else 0.0
+
+def normalize_name(text: str) -> str:
+    """
+    Lowercases and collapses punctuation/whitespace so names from CSVs and
+    file names written by spotdl can be compared.
+    """
+    return re.sub(r"[\W_]+", " ", text or "").strip().lower()
+
+def track_key(track: Track) -> str:
+    """
+    Stable identity for a track: its Spotify ID, or the normalized "artist - title".
+    """
+    if track.spotify_id and track.spotify_id != "null":
+        return f"spotify:{track.spotify_id}"
+    return normalize_name(f"{track.artist} - {track.title}")
+
+def parse_shard(text: str) -> tuple:
+    """
+    Parses "I/N" (1-based, e.g. "2/4") into a 0-based (index, count).
+    """
+    index, _, count = text.partition("/")
+    if not (index.isdigit() and count.isdigit() and 1 <= int(index) <= int(count)):
+        raise ValueError(f"Shard must be I/N with 1 <= I <= N, got {text}")
+    return int(index) - 1, int(count)
+
+def shard_of(track, count: int) -> int:
+    """
+    Deterministic shard of a track. Keyed by track_key, so every playlist entry
+    of the same song lands on the same shard and is still deduplicated there.
+    """
+    digest = hashlib.blake2b(track_key(track).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+def shard_suffix(shard) -> str:
+    return f"_shard{shard[0] + 1}of{shard[1]}" if shard else ""
+
+def manifest_path(root_out: Path, shard=None) -> Path:
+    """
+    Each shard keeps its own manifest so instances sharing a folder don't contend on it.
+    """
+    return root_out / (MANIFEST_FILE_NAME.replace(".sqlite", shard_suffix(shard) + ".sqlite"))
+
+def name_variants(artists: str, title: str) -> set:
+    """
+    Normalized "artist - title" stems for a track or file name. spotdl writes every
+    artist into the file name while CSVs often list only the first one, so the
+    first-artist form is included too.
+    """
+    if not artists:
+        return {normalize_name(title)}
+    first_artist = artists.split(",")[0]
+    return {normalize_name(f"{artists} - {title}"), normalize_name(f"{first_artist} - {title}")}
+
+def file_name_variants(stem: str) -> set:
+    artists, sep, title = stem.partition(" - ")
+    return name_variants(artists, title) if sep else {normalize_name(stem)}
+
+# Upstream throttling, which the rate limiter answers by slowing down
+RATE_LIMIT_PATTERN = re.compile(r"\b429\b|too many requests|rate.?limit", re.IGNORECASE)
+
+# spotdl/yt-dlp messages that point at a temporary upstream problem vs. a track that will never resolve
+TRANSIENT_ERROR_PATTERN = re.compile(
+    r"429|too many requests|rate.?limit|timed? ?out|timeout|connection|temporar|network|ssl|"
+    r"http error 5\d\d|service unavailable|reset by peer|unable to download|ffmpeg", re.IGNORECASE)
+PERMANENT_ERROR_PATTERN = re.compile(
+    r"no results found|lookuperror|not found|invalid|video unavailable|private video|copyright|"
+    r"age.?restricted|not available in your country", re.IGNORECASE)
+
+# spotdl --simple-tui status lines, e.g. "Artist - Title: Downloading 42%"
+PHASE_PATTERNS = [
+    ("done", re.compile(r"downloaded|skipping|done", re.IGNORECASE)),
+    ("embedding", re.compile(r"embedding|metadata", re.IGNORECASE)),
+    ("converting", re.compile(r"convert", re.IGNORECASE)),
+    ("downloading", re.compile(r"download", re.IGNORECASE)),
+    ("searching", re.compile(r"search|processing|looking up|finding", re.IGNORECASE)),
+]
+PERCENT_PATTERN = re.compile(r"(\d{1,3}(?:\.\d+)?)\s?%")
+PHASE_WEIGHTS = {"searching": 0.05, "downloading": 0.1, "converting": 0.85, "embedding": 0.95, "done": 1.0}
+
+class DownloadStalled(subprocess.TimeoutExpired):
+    """
+    Raised when spotdl produced no output for STALL_TIMEOUT_SECONDS.
+    """
+
+def parse_progress_line(line: str):
+    """
+    Maps one line of spotdl output to (phase, percent or None), or None if the
+    line carries no progress information.
+    """
+    for phase, pattern in PHASE_PATTERNS:
+        if pattern.search(line):
+            match = PERCENT_PATTERN.search(line) if phase == "downloading" else None
+            return phase, min(float(match.group(1)), 100.0) if match else None
+    return None
+
+def phase_fraction(phase: str, percent) -> float:
+    """
+    Rough share of a track's work that is done at the given phase.
+    """
+    if phase == "downloading" and percent is not None:
+        return PHASE_WEIGHTS["downloading"] + (PHASE_WEIGHTS["converting"] - PHASE_WEIGHTS["downloading"]) * percent / 100
+    return PHASE_WEIGHTS.get(phase, 0.0)
+
+class LineSplitter:
+    """
+    Turns raw output chunks into lines. Progress bars redraw with a bare carriage
+    return, so both CR and LF end a line.
+    """
+    def __init__(self):
+        self._pending = b""
+
+    def feed(self, chunk: bytes) -> list:
+        parts = re.split(rb"[\r\n]", self._pending + chunk)
+        self._pending = parts.pop()
+        return [part.decode("utf-8", errors="replace").strip() for part in parts if part.strip()]
+
+    def flush(self) -> list:
+        rest, self._pending = self._pending, b""
+        return [rest.decode("utf-8", errors="replace").strip()] if rest.strip() else []
+
+def classify_failure(error) -> str:
+    """
+    Sorts a failed download into "transient" (worth retrying) or "permanent".
+    """
+    if isinstance(error, subprocess.TimeoutExpired):
+        return "transient"
+    if isinstance(error, subprocess.CalledProcessError):
+        if error.returncode is not None and error.returncode < 0:
+            return "transient" # Killed by a signal
+        output = str(error.stderr or "")
+        if TRANSIENT_ERROR_PATTERN.search(output):
+            return "transient"
+        if PERMANENT_ERROR_PATTERN.search(output):
+            return "permanent"
+        return "transient"
+    return "permanent"
+
+def process_group_kwargs() -> dict:
+    """
+    Popen arguments that start a child in its own process group, so it can be
+    killed together with everything it spawns (ffmpeg, yt-dlp helpers).
+    """
+    if os.name == "nt":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+def signal_process_group(proc, kill: bool = False):
+    """
+    Terminates (or kills) the process group of a Popen or asyncio Process.
+    """
+    with contextlib.suppress(ProcessLookupError, PermissionError, OSError):
+        if os.name == "nt":
+            if kill:
+                subprocess.run(["taskkill", "/F", "/T", "/PID", str(proc.pid)], capture_output=True)
+            else:
+                os.kill(proc.pid, signal.CTRL_BREAK_EVENT)
+        else:
+            os.killpg(proc.pid, signal.SIGKILL if kill else signal.SIGTERM)
+
+def run_tracked(cmd: list, timeout: float, registry=None, on_line=None,
+                stall_timeout: float = None, timings: dict = None) -> subprocess.CompletedProcess:
+    """
+    Runs cmd in its own process group, visible to registry while it runs, and reads
+    its (merged) output incrementally: every line goes to on_line and only the last
+    OUTPUT_TAIL_LINES are kept. Raises like subprocess.run(check=True), plus
+    DownloadStalled when the child stays silent for stall_timeout seconds.
+    The time Popen took is stored in timings["spawn"].
+    """
+    spawn_started = time.monotonic()
+    proc = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        **process_group_kwargs()
+    )
+    if timings is not None:
+        timings["spawn"] = time.monotonic() - spawn_started
+    if registry:
+        registry.add(proc)
+    tail = deque(maxlen=OUTPUT_TAIL_LINES)
+    last_output = [time.monotonic()]
+
+    def pump():
+        splitter = LineSplitter()
+        for chunk in iter(lambda: proc.stdout.read1(65536), b""):
+            last_output[0] = time.monotonic()
+            for line in splitter.feed(chunk):
+                tail.append(line)
+                if on_line:
+                    on_line(line)
+        tail.extend(splitter.flush())
+
+    reader = threading.Thread(target=pump, daemon=True)
+    reader.start()
+    deadline = time.monotonic() + timeout
+    try:
+        # The pipe closes when the process group exits, so joining the reader is the wait
+        while reader.is_alive():
+            reader.join(0.5)
+            now = time.monotonic()
+            if now > deadline:
+                raise subprocess.TimeoutExpired(cmd, timeout, output="\n".join(tail))
+            if stall_timeout and now - last_output[0] > stall_timeout:
+                raise DownloadStalled(cmd, stall_timeout, output="\n".join(tail))
+        proc.wait(timeout=max(deadline - time.monotonic(), 0.1))
+    except subprocess.TimeoutExpired:
+        signal_process_group(proc, kill=True)
+        proc.wait()
+        raise
+    finally:
+        if registry:
+            registry.discard(proc)
+        proc.stdout.close()
+    output = "\n".join(tail)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output, output)
+    return subprocess.CompletedProcess(cmd, proc.returncode, output, output)
+
+def _fragment_stems(name: str):
+    """
+    name with one more suffix stripped each time, e.g. "A - T.f251.webm.part" gives
+    "A - T.f251.webm", "A - T.f251", "A - T".
+    """
+    for _ in range(4):
+        name, ext = os.path.splitext(name)
+        if not ext:
+            return
+        yield name
+
+def cleanup_partial_files(folders, tracks=None) -> int:
+    """
+    Deletes leftover download fragments in folders, only those of tracks when it is
+    given. Returns how many were removed.
+    """
+    wanted = set().union(*(name_variants(track.artist, track.title) for track in tracks)) if tracks is not None else None
+    removed = 0
+    for folder in folders:
+        for pattern in PARTIAL_FILE_PATTERNS:
+            for path in Path(folder).glob(pattern):
+                if wanted is not None and not any(wanted & file_name_variants(stem) for stem in _fragment_stems(path.name)):
+                    continue
+                with contextlib.suppress(OSError):
+                    path.unlink()
+                    removed += 1
+    return removed
+
+def transcode_audio(source: Path, loudnorm: bool = False, registry=None) -> Path:
+    """
+    Converts a natively downloaded file to OUTPUT_FORMAT with ffmpeg, carrying over
+    its tags and cover art, and deletes the source. Returns the new file. The output
+    is written as *.tmp first, so a killed transcode leaves nothing that looks finished.
+    """
+    target = source.with_suffix(f".{OUTPUT_FORMAT}")
+    if target == source and not loudnorm:
+        return source
+    partial = target.with_name(target.name + ".tmp")
+    # Ogg keeps its tags on the audio stream, other containers on the file
+    tags = "0:s:a:0" if source.suffix.lower() in (".opus", ".ogg") else "0"
+    cmd = [FFMPEG_CMD, "-nostdin", "-hide_banner", "-loglevel", "error", "-y", "-i", str(source),
+           "-map", "0:a:0", "-map", "0:v?", "-c:v", "copy", "-map_metadata", tags,
+           *(["-af", LOUDNORM_FILTER] if loudnorm else []), *TRANSCODE_ARGS, "-f", OUTPUT_FORMAT, str(partial)]
+    try:
+        run_tracked(cmd, TRANSCODE_TIMEOUT, registry)
+    except Exception:
+        with contextlib.suppress(OSError):
+            partial.unlink()
+        raise
+    os.replace(partial, target)
+    if target != source:
+        with contextlib.suppress(OSError):
+            source.unlink()
+    return target
+
+# ------------------ Verification ------------------
+# MPEG audio bitrates in kbps by (MPEG-1?, layer) and header index; 0 = free format, unsupported
+MP3_BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)} # By version bits
+
+def _mp3_frame(data: bytes, pos: int):
+    """
+    Decodes the MPEG audio frame header at pos. Returns (frame length, samples,
+    sample rate, MPEG-1?, mono?) or None if there is no valid header.
+    """
+    if pos + 4 > len(data) or data[pos] != 0xFF or data[pos + 1] & 0xE0 != 0xE0:
+        return None
+    version, layer = (data[pos + 1] >> 3) & 3, 4 - ((data[pos + 1] >> 1) & 3)
+    bitrate_index, rate_index = data[pos + 2] >> 4, (data[pos + 2] >> 2) & 3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = MP3_BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+    padding = (data[pos + 2] >> 1) & 1
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate, mpeg1, False
+    samples = 576 if layer == 3 and not mpeg1 else 1152
+    mono = data[pos + 3] >> 6 == 3
+    return samples // 8 * bitrate // sample_rate + padding, samples, sample_rate, mpeg1, mono
+
+def _mp3_audio_bounds(data: bytes) -> tuple:
+    """
+    (start, end) of the data between a leading ID3v2 tag and trailing ID3v1/APE tags.
+    """
+    start, end = 0, len(data)
+    if data[:3] == b"ID3" and end >= 10:
+        size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+        start = 10 + size + (10 if data[5] & 0x10 else 0) # Optional footer
+    if end - start >= 128 and data[end - 128:end - 125] == b"TAG":
+        end -= 128
+    if end - start >= 32 and data[end - 32:end - 24] == b"APETAGEX":
+        size = int.from_bytes(data[end - 20:end - 16], "little")
+        has_header = data[end - 9] & 0x80
+        end -= min(size + (32 if has_header else 0), end - start)
+    return start, end
+
+def mp3_duration(path: Path) -> float:
+    """
+    Walks the frames of an MP3 file and returns its length in seconds. Raises
+    ValueError when there are no frames, the last frame is cut off, or fewer
+    frames are left than the encoder's Xing/Info header recorded.
+    """
+    data = path.read_bytes()
+    start, end = _mp3_audio_bounds(data)
+
+    # First frame: a sync word whose frame is followed by another one (or the end)
+    pos, limit = start, min(start + VERIFY_MP3_SYNC_SEARCH_BYTES, end)
+    while pos < limit:
+        pos = data.find(b"\xff", pos, limit)
+        if pos < 0:
+            break
+        frame = _mp3_frame(data, pos)
+        if frame and (pos + frame[0] >= end or _mp3_frame(data, pos + frame[0])):
+            break
+        pos += 1
+    else:
+        pos = -1
+    if pos < 0:
+        raise ValueError("no MP3 audio frames")
+
+    # A Xing/Info frame carries no audio but knows how many frames the encoder wrote
+    length, samples, sample_rate, mpeg1, mono = _mp3_frame(data, pos)
+    tag = pos + 4 + (17 if mpeg1 == mono else 32 if mpeg1 else 9)
+    expected_frames = None
+    if data[tag:tag + 4] in (b"Xing", b"Info"):
+        if len(data) >= tag + 12 and data[tag + 7] & 1:
+            expected_frames = int.from_bytes(data[tag + 8:tag + 12], "big")
+        pos += length
+
+    frames, seconds = 0, 0.0
+    while pos < end:
+        frame = _mp3_frame(data, pos)
+        if frame is None:
+            break
+        length, samples, sample_rate = frame[:3]
+        if pos + length > end:
+            raise ValueError(f"truncated: last frame cut off after {seconds:.0f}s")
+        pos += length
+        frames += 1
+        seconds += samples / sample_rate
+    if end - pos > VERIFY_MP3_MAX_JUNK_BYTES:
+        raise ValueError(f"{end - pos} unreadable bytes after {seconds:.0f}s")
+    if expected_frames and frames + 1 < expected_frames:
+        raise ValueError(f"truncated: {frames} of {expected_frames} frames ({seconds:.0f}s)")
+    return seconds
+
+class VerificationError(Exception):
+    """
+    A file could not be checked (ffmpeg missing or timed out, file unreadable).
+    Says nothing about the file itself, so it must never be deleted for it.
+    """
+
+def decoded_duration(path: Path) -> float:
+    """
+    Decodes path completely with ffmpeg and returns the seconds of audio it got.
+    Raises ValueError on decode errors and VerificationError when ffmpeg can't do the check.
+    """
+    cmd = [FFMPEG_CMD, "-nostdin", "-hide_banner", "-loglevel", "error", "-i", str(path),
+           "-map", "0:a:0", "-f", "null", "-progress", "pipe:1", "-"]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, errors="replace", timeout=VERIFY_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        raise VerificationError(f"decode check timed out ({VERIFY_TIMEOUT}s)")
+    except OSError as e:
+        raise VerificationError(f"could not run {FFMPEG_CMD}: {e}")
+    errors = result.stderr.strip().splitlines()
+    if errors:
+        raise ValueError(errors[-1])
+    if result.returncode != 0:
+        raise VerificationError(f"{FFMPEG_CMD} exit code {result.returncode}")
+    times = re.findall(r"^out_time_us=(\d+)", result.stdout, re.MULTILINE)
+    return int(times[-1]) / 1_000_000 if times else 0.0
+
+def verify_audio_file(path: Path, expected: float = 0.0) -> str:
+    """
+    Checks that path is complete, playable audio of about the expected length
+    (seconds, 0 = unknown). Returns "" for a good file, otherwise what is wrong.
+    MP3s are parsed natively; other formats are decoded with ffmpeg. Raises
+    VerificationError when the check itself fails.
+    """
+    try:
+        if path.stat().st_size == 0:
+            return "empty file"
+        seconds = mp3_duration(path) if path.suffix.lower() == ".mp3" else decoded_duration(path)
+    except ValueError as e:
+        return str(e)
+    except OSError as e:
+        raise VerificationError(f"could not read {path.name}: {e}")
+    if seconds <= 0:
+        return "no audio"
+    if expected and expected - seconds > max(VERIFY_DURATION_SLACK_SECONDS, expected * VERIFY_DURATION_TOLERANCE):
+        return f"too short: {seconds:.0f}s of {expected:.0f}s"
+    return ""
+
+def verify_track_file(folder: Path, track: Track, path=None) -> tuple:
+    """
+    Finds (unless path is given) and checks the file downloaded for track. Runs in
+    the verification process pool. Returns (path or None, problem, seconds taken).
+    """
+    started = time.monotonic()
+    path = path or LibraryIndex.locate(folder, track)
+    problem = verify_audio_file(path, track.duration) if path else ""
+    return path, problem, time.monotonic() - started
+
+def _ignore_interrupt():
+    # Ctrl+C is handled by the coordinator, which shuts the pool down itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def verification_pool(workers: int = VERIFY_WORKERS) -> concurrent.futures.ProcessPoolExecutor:
+    # Spawned rather than forked: the coordinator process runs many threads
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                                  initializer=_ignore_interrupt)
+
+def _check_library_file(path: Path) -> tuple:
+    """
+    (problem, error) for one file of verify_library; error is set when it couldn't be checked.
+    """
+    try:
+        return verify_audio_file(path), ""
+    except VerificationError as e:
+        return "", str(e)
+
+def verify_library(root_out: Path, delete: bool = False, workers: int = VERIFY_WORKERS, extensions=AUDIO_EXTENSIONS):
+    """
+    Checks every audio file under root_out with one of extensions in parallel.
+    Yields (path, problem, error) per file: problem is "" for a good file, error
+    is set when it could not be checked. Only corrupt files are deleted, and only
+    when delete is set.
+    """
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root_out):
+        dirnames[:] = [name for name in dirnames if not name.startswith(".")] # Leases and other bookkeeping
+        paths.extend(Path(dirpath) / name for name in filenames if os.path.splitext(name)[1].lower() in extensions)
+    with verification_pool(workers) as pool:
+        for path, (problem, error) in zip(paths, pool.map(_check_library_file, paths, chunksize=16)):
+            if problem and delete:
+                with contextlib.suppress(OSError):
+                    path.unlink()
+            yield path, problem, error
+
+def split_links(text: str) -> list:
+    """
+    Accepts several links separated by whitespace, commas or new lines.
+    """
+    return [link for link in re.split(r"[\s,]+", text or "") if link]
+
+def resolve_spotify_link(link: str, fallback_playlist: str = "Playlist", registry=None) -> list:
+    """
+    Expands a Spotify playlist, album, artist or track link into one Track per
+    song using spotdl's metadata-only "save" operation.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        save_file = Path(tmp) / "resolved.spotdl"
+        run_tracked([SPOTDL_CMD, "save", link, "--save-file", str(save_file), "--log-level", "ERROR"],
+                    RESOLVE_TIMEOUT, registry)
+        with open(save_file, "r", encoding="utf-8") as f:
+            songs = json.load(f)
+
+    return [Track(
+        title=song.get("name") or "",
+        artist=", ".join(song.get("artists") or []) or song.get("artist") or "",
+        playlist=song.get("list_name") or fallback_playlist,
+        spotify_id=song.get("song_id") or "",
+        duration=float(song.get("duration") or 0)
+    ) for song in songs]
+
+def link_or_copy(source: Path, dest_folder: Path) -> Path:
+    """
+    Places source into dest_folder as a hardlink, falling back to a copy
+    (e.g. across filesystems). An existing file of the same name is kept.
+    """
+    dest = dest_folder / source.name
+    if dest.exists():
+        return dest
+    dest_folder.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copy2(source, dest)
+    return dest
+
+def iter_batches(tracks, batch_size: int):
+    """
+    Groups tracks by their playlist folder (spotdl's --output is per folder)
+    and yields chunks of at most batch_size tracks.
+    """
+    groups = {}
+    for track in tracks:
+        folder = sanitize_for_filesystem(track.playlist)
+        group = groups.setdefault(folder, [])
+        group.append(track)
+        if len(group) >= batch_size:
+            yield groups.pop(folder)
+
+    for group in groups.values():
+        if group:
+            yield group
+
+# ------------------ Scheduling ------------------
+def schedule_fifo(tracks):
+    """
+    Input order, streamed without buffering.
+    """
+    return iter(tracks)
+
+def _group_by_playlist(tracks) -> list:
+    playlists = {}
+    for track in tracks:
+        playlists.setdefault(track.playlist, deque()).append(track)
+    return list(playlists.values())
+
+def schedule_round_robin(tracks):
+    """
+    One track from each playlist in turn, so a huge playlist doesn't starve the
+    others. Reads the whole input before yielding.
+    """
+    queues = deque(_group_by_playlist(tracks))
+    while queues:
+        queue = queues.popleft()
+        yield queue.popleft()
+        if queue:
+            queues.append(queue)
+
+def schedule_shortest_first(tracks):
+    """
+    Whole playlists one after another, smallest first, so finished playlists can
+    be played while the rest downloads. Reads the whole input before yielding.
+    """
+    for queue in sorted(_group_by_playlist(tracks), key=len):
+        yield from queue
+
+# Orderings the coordinator can hand tracks to the executor in; each takes and returns an iterable of Track
+SCHEDULERS = {
+    "FIFO": schedule_fifo,
+    "Round robin": schedule_round_robin,
+    "Shortest playlist first": schedule_shortest_first,
+}
+SCHEDULER_OPTIONS = {"fifo": "FIFO", "round-robin": "Round robin", "shortest-first": "Shortest playlist first"} # CLI spelling
+
+# ------------------ Progress State ------------------
+class ProgressState:
+    """
+    Aggregated run progress. Workers and the coordinator update counters and the
+    set of active downloads under a lock; the UI takes a snapshot once per tick
+    and renders it, instead of reacting to every individual event.
+    """
+    def __init__(self, total: int = 0):
+        self._lock = threading.Lock()
+        self.total = total
+        self.completed = 0
+        self.errors = 0
+        self.present = 0
+        self.linked = 0
+        self.retries = 0
+        self.status = "Ready"
+        self.concurrency = ""
+        self.active = {} # job key -> label
+        self.phases = {} # job key -> (phase, percent), from spotdl's output
+        self.playlists = {} # playlist -> [finished tracks, registered tracks]
+        self.playlists_final = False # Set once the whole input has been registered
+        self.playlists_done = set()
+        self.finished = False
+        self.version = 0 # Bumped on every change so the UI can skip idle ticks
+
+    def _changed(self):
+        self.version += 1
+
+    def set_total(self, total: int):
+        with self._lock:
+            self.total = max(total, 1)
+            self._changed()
+
+    def set_status(self, status: str):
+        with self._lock:
+            self.status = status
+            self._changed()
+
+    def set_concurrency(self, limit: int, reason: str):
+        with self._lock:
+            self.concurrency = f"Concurrency: {limit} ({reason})"
+            self._changed()
+
+    def track_started(self, key, label: str):
+        with self._lock:
+            self.active[key] = label
+            self._changed()
+
+    def track_progress(self, key, phase: str, percent=None):
+        with self._lock:
+            if key in self.active and self.phases.get(key) != (phase, percent):
+                self.phases[key] = (phase, percent)
+                self._changed()
+
+    def track_finished(self, key):
+        with self._lock:
+            self.active.pop(key, None)
+            self.phases.pop(key, None)
+            self._changed()
+
+    def _active_rows(self) -> list:
+        rows = []
+        for key, label in self.active.items():
+            phase, percent = self.phases.get(key, ("starting", None))
+            rows.append(f"{label} — {phase}" + (f" {percent:.0f}%" if percent is not None else ""))
+        return rows
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+            self._changed()
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+            self._changed()
+
+    def playlist_added(self, playlist: str):
+        with self._lock:
+            self.playlists.setdefault(playlist, [0, 0])[1] += 1
+
+    def _complete_playlist(self, playlist: str) -> bool:
+        counts = self.playlists.get(playlist)
+        if (not self.playlists_final or counts is None or counts[0] < counts[1]
+                or playlist in self.playlists_done):
+            return False
+        self.playlists_done.add(playlist)
+        return True
+
+    def input_complete(self) -> list:
+        """
+        Marks the playlist totals final. Returns the playlists that are complete now.
+        """
+        with self._lock:
+            self.playlists_final = True
+            self._changed()
+            return [playlist for playlist in self.playlists if self._complete_playlist(playlist)]
+
+    def record_result(self, result: dict) -> bool:
+        """
+        Counts a final result. Returns True when it completed its playlist.
+        """
+        with self._lock:
+            if not result["success"]:
+                self.errors += 1
+            if result.get("present"):
+                self.present += 1
+            if result.get("linked") and result["success"]:
+                self.linked += 1
+            completed_playlist = False
+            if not result["skipped"]:
+                self.completed += 1
+                playlist = result["track"].playlist
+                if playlist in self.playlists:
+                    self.playlists[playlist][0] += 1
+                    completed_playlist = self._complete_playlist(playlist)
+            self._changed()
+            return completed_playlist
+
+    def _playlist_rows(self) -> list:
+        # Playlists in progress first (furthest along on top), then finished ones
+        def order(item):
+            name, (done, total) = item
+            return (name in self.playlists_done, -(done / total if total else 0))
+        rows = []
+        for name, (done, total) in heapq.nsmallest(UI_MAX_PLAYLIST_ROWS, self.playlists.items(), key=order):
+            rows.append(f"{'✓ ' if name in self.playlists_done else ''}{name}: {done} / {total}")
+        return rows
+
+    def finish(self):
+        with self._lock:
+            self.finished = True
+            self._changed()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "version": self.version,
+                "total": self.total,
+                "completed": self.completed,
+                "errors": self.errors,
+                "present": self.present,
+                "linked": self.linked,
+                "retries": self.retries,
+                "status": self.status,
+                "concurrency": self.concurrency,
+                "active": self._active_rows(),
+                "playlists": self._playlist_rows(),
+                "playlists_total": len(self.playlists),
+                "playlists_finished": len(self.playlists_done),
+                "in_flight": sum(phase_fraction(*phase) for phase in self.phases.values()),
+                "finished": self.finished,
+            }
+
+# ------------------ Adaptive Concurrency ------------------
+class AdaptiveConcurrency:
+    """
+    AIMD controller for the "auto" concurrency mode. Tracks completions, errors and
+    timeouts over a sliding window; raises the limit additively while throughput
+    keeps climbing and halves it when the error rate spikes.
+    """
+    def __init__(self, start: int, minimum: int = AUTO_CONCURRENCY_MIN, maximum: int = AUTO_CONCURRENCY_MAX):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(start, maximum))
+        self.events = deque() # (timestamp, success, timed_out)
+        self.started = time.monotonic()
+        self.last_evaluation = self.started
+        self.last_throughput = 0.0
+
+    def record(self, success: bool, timed_out: bool = False):
+        self.events.append((time.monotonic(), success, timed_out))
+
+    def evaluate(self):
+        """
+        Returns a human readable reason when the limit changed, otherwise None.
+        """
+        now = time.monotonic()
+        if now - self.last_evaluation < AUTO_CONCURRENCY_INTERVAL_SECONDS:
+            return None
+        self.last_evaluation = now
+
+        while self.events and now - self.events[0][0] > AUTO_CONCURRENCY_WINDOW_SECONDS:
+            self.events.popleft()
+        if len(self.events) < 5:
+            return None # Not enough samples to judge
+
+        span_minutes = min(AUTO_CONCURRENCY_WINDOW_SECONDS, now - self.started) / 60
+        throughput = sum(1 for _, success, _ in self.events if success) / span_minutes
+
+        # Errors are judged on the latest interval so a spike is acted on right away
+        recent = [event for event in self.events if now - event[0] <= AUTO_CONCURRENCY_INTERVAL_SECONDS]
+        if len(recent) < 5:
+            recent = self.events
+        error_rate = sum(1 for _, success, _ in recent if not success) / len(recent)
+        timeouts = sum(1 for _, _, timed_out in recent if timed_out)
+
+        new_limit, reason = self.limit, None
+        if error_rate >= AUTO_CONCURRENCY_ERROR_RATE:
+            new_limit = max(self.minimum, self.limit // 2)
+            reason = f"backing off, {error_rate:.0%} errors ({timeouts} timeouts)"
+        elif throughput > self.last_throughput * 1.05:
+            new_limit = min(self.maximum, self.limit + AUTO_CONCURRENCY_STEP)
+            reason = f"throughput rising, {throughput:.1f} tracks/min"
+        elif throughput < self.last_throughput * 0.8:
+            new_limit = max(self.minimum, self.limit - 1)
+            reason = f"throughput falling, {throughput:.1f} tracks/min"
+        self.last_throughput = throughput
+
+        if new_limit == self.limit:
+            return None
+        self.limit = new_limit
+        return reason
+
+# ------------------ Rate Limiter ------------------
+class TokenBucket:
+    """
+    Global limit on how fast spotdl processes are started, shared by all workers.
+    Tokens refill at rate per second up to burst. Each start takes a ticket for its
+    tokens and waits until the refill has reached it, so waiters are served in
+    order and their wait always follows the current rate. penalize() cuts the
+    rate for a while after upstream throttling.
+    """
+    def __init__(self, rate: float, burst: int):
+        self.base_rate = rate
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.issued = 0.0 # Tokens handed out as tickets so far
+        self.granted = float(self.burst) # Tokens refilled so far; a ticket is due once this reaches it
+        self.updated = time.monotonic()
+        self.penalty_until = 0.0
+        self._lock = threading.Lock()
+
+    def _credit(self, until: float):
+        self.granted = min(self.issued + self.burst, self.granted + max(0.0, until - self.updated) * self.rate)
+        self.updated = max(self.updated, until)
+
+    def _refill(self, now: float):
+        if self.penalty_until and now >= self.penalty_until:
+            self._credit(self.penalty_until) # The penalty's time still refills at its rate
+            self.rate, self.penalty_until = self.base_rate, 0.0
+        self._credit(now)
+
+    def reserve(self, cost: int = 1) -> float:
+        """
+        Takes cost tokens and returns the ticket to pass to delay().
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.issued += min(cost, self.burst) # A batch larger than the burst would never fit
+            return self.issued
+
+    def delay(self, ticket: float) -> float:
+        """
+        Seconds until ticket is due at the current rate; 0 when it may start.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0.0, (ticket - self.granted) / self.rate)
+
+    def penalize(self):
+        """
+        Lowers the rate to a fixed share of the base rate after a rate-limit error.
+        Returns the new rate, or None when the hit only extended the current penalty.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # Concurrent downloads tend to fail together, so hits extend a penalty rather than stack
+            started = not self.penalty_until
+            self.penalty_until = now + RATE_LIMIT_PENALTY_SECONDS
+            if not started:
+                return None
+            self.rate = max(RATE_LIMIT_MIN_PER_SECOND, self.base_rate * RATE_LIMIT_PENALTY_FACTOR)
+            self.granted = min(self.granted, self.issued) # No burst right after being throttled
+            return self.rate
+
+# ------------------ Retry Scheduler ------------------
+class RetryScheduler:
+    """
+    Holds transiently failed tracks outside the worker pool until they are due:
+    their jittered exponential backoff has elapsed and RETRY_AFTER_SUCCESS_COUNT
+    downloads have succeeded since they failed.
+    """
+    def __init__(self, base_delay: float = RETRY_BASE_DELAY_SECONDS, max_delay: float = RETRY_MAX_DELAY_SECONDS,
+                 successes_needed: int = RETRY_AFTER_SUCCESS_COUNT):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.successes_needed = successes_needed
+        self.successes = 0
+        self._heap = [] # (due_at, seq, successes_mark, track, attempt)
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def record_success(self):
+        self.successes += 1
+
+    def schedule(self, track: Track, attempt: int) -> float:
+        """
+        Queues the next attempt (attempt is 1-based) and returns its delay in seconds.
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 2)) * random.uniform(0.5, 1.5)
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq),
+                                    self.successes + self.successes_needed, track, attempt))
+        return delay
+
+    def pop_ready(self, drain: bool = False):
+        """
+        Returns (track, attempt) for the next due retry, or None. With drain set
+        (no fresh work left to produce successes) only the backoff is honoured.
+        """
+        if not self._heap:
+            return None
+        due_at, _, successes_mark, track, attempt = self._heap[0]
+        if due_at > time.monotonic() or (not drain and self.successes < successes_mark):
+            return None
+        heapq.heappop(self._heap)
+        return track, attempt
+
+    def next_due_in(self) -> float:
+        return max(0.0, self._heap[0][0] - time.monotonic()) if self._heap else 0.0
+
+# ------------------ Deduplication ------------------
+class DuplicateEntry:
+    __slots__ = ("state", "primary", "source", "error", "waiters")
+
+    def __init__(self, primary: Track):
+        self.state = "pending" # pending, done, failed, or elsewhere (leased by another instance)
+        self.primary = primary # None once resolved, like waiters, so finished tracks aren't kept alive
+        self.source = None # Path of the downloaded file once done
+        self.error = ""
+        self.waiters = [] # Same track listed under other playlists
+
+class DuplicateTracker:
+    """
+    Makes sure each unique track (by track_key) is fetched from the network once.
+    Later playlist entries of the same track wait for that download and are then
+    hardlinked (or copied) into their own playlist folder.
+    """
+    def __init__(self):
+        self.entries = {}
+
+    def claim(self, track: Track):
+        """
+        Returns "download" when track is the first of its kind, otherwise the
+        DuplicateEntry it depends on (and queues it as a waiter if still pending).
+        """
+        key = track_key(track)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.entries[key] = DuplicateEntry(track)
+            return "download"
+        if entry.state == "pending":
+            entry.waiters.append(track)
+        return entry
+
+    def resolve(self, track: Track, success: bool, source, error: str) -> list:
+        """
+        Records the final outcome of a primary download and returns its waiters.
+        Only the outcome stays in the entry, so a long job keeps no Track per unique track.
+        """
+        entry = self.entries.get(track_key(track))
+        if entry is None or entry.primary is not track:
+            return []
+        entry.state = "done" if success and source else "failed"
+        entry.source = source
+        entry.error = error
+        waiters = entry.waiters
+        entry.primary = entry.waiters = None
+        return waiters
+
+# ------------------ Job Manifest ------------------
+class JobManifest:
+    """
+    On-disk SQLite record of every track in a job (track key, playlist, expected
+    length, status, attempts, duration, error) so an interrupted job can be resumed. A fresh
+    start begins a new job; rows of older jobs in the same folder are only
+    re-queued by Resume if the new job registers them again.
+    Owned by the coordinator thread; results are committed in batches.
+    """
+    def __init__(self, path: Path, resume: bool = False):
+        self.path = path
+        self.conn = sqlite3.connect(str(path), timeout=30)
+        # Rollback journal rather than WAL, like the query cache: shard manifests may live on a NAS
+        self.conn.execute("PRAGMA journal_mode=DELETE")
+        self._migrate(self.conn)
+        self.job = self._current_job(self.conn) if resume else None
+        if self.job is None:
+            self.job = f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('job', ?)", (self.job,))
+        self.conn.commit()
+        self._pending_inserts = []
+        self._pending_updates = []
+        self._last_commit = time.monotonic()
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                playlist TEXT NOT NULL,
+                track_key TEXT NOT NULL,
+                title TEXT,
+                artist TEXT,
+                spotify_id TEXT,
+                track_length REAL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                duration REAL,
+                error TEXT,
+                updated REAL,
+                job TEXT,
+                PRIMARY KEY (playlist, track_key)
+            )""")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if "job" not in columns:
+            # Manifests from before job ids: everything in them counts as one job, which Resume continues
+            conn.execute("ALTER TABLE jobs ADD COLUMN job TEXT")
+            conn.execute("UPDATE jobs SET job = 'legacy'")
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('job', 'legacy')")
+        if "track_length" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN track_length REAL") # Expected seconds, for verification
+        conn.commit()
+
+    @staticmethod
+    def _current_job(conn: sqlite3.Connection):
+        row = conn.execute("SELECT value FROM meta WHERE key = 'job'").fetchone()
+        return row[0] if row else None
+
+    def _maybe_flush(self):
+        if (len(self._pending_inserts) + len(self._pending_updates) >= MANIFEST_COMMIT_EVERY
+                or time.monotonic() - self._last_commit >= MANIFEST_COMMIT_INTERVAL_SECONDS):
+            self.flush()
+
+    def add(self, track: Track):
+        self._pending_inserts.append((track.playlist, track_key(track), track.title, track.artist,
+                                      track.spotify_id, track.duration, time.time(), self.job))
+        self._maybe_flush()
+
+    def record(self, result: dict):
+        if result.get("skipped"):
+            return # Stopped before finishing; stays pending for the next resume
+        track = result["track"]
+        ran = not (result.get("present") or result.get("linked") or result.get("elsewhere"))
+        self._pending_updates.append((
+            # "elsewhere" (leased by another instance) stays unfinished so a resume re-checks it
+            "elsewhere" if result.get("elsewhere") else "done" if result["success"] else "failed",
+            result.get("attempt", 1) if ran else 0, # Only spotdl runs count as attempts
+            result.get("duration"),
+            result.get("error", ""),
+            time.time(),
+            track.playlist,
+            track_key(track)
+        ))
+        self._maybe_flush()
+
+    def flush(self):
+        # Inserts go first so a job registered and finished within one batch is updated
+        if self._pending_inserts:
+            # A track of an older job joins this one and starts over; one already in it is left alone
+            self.conn.executemany(
+                "INSERT INTO jobs (playlist, track_key, title, artist, spotify_id, track_length, updated, job) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (playlist, track_key) DO UPDATE SET "
+                "job = excluded.job, track_length = excluded.track_length, status = 'pending', "
+                "attempts = 0, error = NULL, updated = excluded.updated WHERE jobs.job IS NOT excluded.job",
+                self._pending_inserts
+            )
+            self._pending_inserts.clear()
+        if self._pending_updates:
+            self.conn.executemany(
+                "UPDATE jobs SET status = ?, attempts = attempts + ?, duration = ?, error = ?, updated = ? "
+                "WHERE playlist = ? AND track_key = ?",
+                self._pending_updates
+            )
+            self._pending_updates.clear()
+        self.conn.commit()
+        self._last_commit = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    @staticmethod
+    def count_unfinished(path: Path) -> int:
+        conn = sqlite3.connect(str(path), timeout=30)
+        try:
+            JobManifest._migrate(conn)
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE status != 'done' AND job = "
+                                "(SELECT value FROM meta WHERE key = 'job')").fetchone()[0]
+        finally:
+            conn.close()
+
+    @staticmethod
+    def load_unfinished(path: Path):
+        """
+        Yields the pending and failed tracks of the last job as Tracks. Reads in short
+        pages by rowid, so no read stays open while the resumed job writes.
+        """
+        conn = sqlite3.connect(str(path), timeout=30)
+        try:
+            JobManifest._migrate(conn)
+            last = 0
+            while rows := conn.execute(
+                "SELECT rowid, title, artist, playlist, spotify_id, track_length FROM jobs WHERE rowid > ? AND "
+                "status != 'done' AND job = (SELECT value FROM meta WHERE key = 'job') ORDER BY rowid LIMIT 1000",
+                (last,)
+            ).fetchall():
+                last = rows[-1][0]
+                for _, title, artist, playlist, spotify_id, track_length in rows:
+                    yield Track(title or "", artist or "", playlist, spotify_id or "", track_length or 0.0)
+        finally:
+            conn.close()
+
+# ------------------ Query Cache ------------------
+class QueryCache:
+    """
+    Remembers the Spotify track and audio source spotdl resolved each track to, so
+    later runs pass "source_url|spotify_url" and spotdl skips both searches. Entries
+    live in memory during a run (workers look them up) and are written back by the
+    coordinator; on close, expired and least recently used entries are evicted.
+    The cache is only an optimisation: database errors are reported, never raised.
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._dirty = {} # track_key -> row to upsert
+        self._invalid = set()
+        self._last_commit = time.monotonic()
+        self.conn = None
+        try:
+            self.conn = sqlite3.connect(str(path), timeout=30)
+            # Rollback journal rather than WAL: the folder may be on a NAS shared by several instances,
+            # and WAL's shared memory index doesn't work over network filesystems
+            self.conn.execute("PRAGMA journal_mode=DELETE")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS queries (
+                    track_key TEXT PRIMARY KEY,
+                    spotify_url TEXT NOT NULL,
+                    source_url TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )""")
+            self.conn.commit()
+            cutoff = time.time() - QUERY_CACHE_TTL_SECONDS
+            self.entries = {key: (spotify_url, source_url, created) for key, spotify_url, source_url, created in
+                            self.conn.execute("SELECT track_key, spotify_url, source_url, created FROM queries "
+                                              "WHERE created >= ?", (cutoff,))}
+        except sqlite3.Error as e:
+            print(f"Query cache disabled: {e}")
+            self._disconnect()
+
+    def _disconnect(self):
+        if self.conn is not None:
+            with contextlib.suppress(sqlite3.Error):
+                self.conn.close()
+        self.conn = None
+
+    def lookup(self, track: Track):
+        """
+        Returns the resolved "source_url|spotify_url" query for track, or None.
+        """
+        key = track_key(track)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            spotify_url, source_url, created = entry
+            self._dirty[key] = (key, spotify_url, source_url, created, time.time())
+        return f"{source_url}|{spotify_url}"
+
+    def store(self, track: Track, spotify_url: str, source_url: str):
+        key = track_key(track)
+        now = time.time()
+        with self._lock:
+            self.entries[key] = (spotify_url, source_url, now)
+            self._dirty[key] = (key, spotify_url, source_url, now, now)
+            self._invalid.discard(key)
+
+    def invalidate(self, track: Track):
+        """
+        Drops a cached match that failed, so the next run searches again.
+        """
+        key = track_key(track)
+        with self._lock:
+            self.entries.pop(key, None)
+            self._dirty.pop(key, None)
+            self._invalid.add(key)
+
+    def maybe_flush(self):
+        if time.monotonic() - self._last_commit >= MANIFEST_COMMIT_INTERVAL_SECONDS:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            dirty, self._dirty = list(self._dirty.values()), {}
+            invalid, self._invalid = [(key,) for key in self._invalid], set()
+        self._last_commit = time.monotonic()
+        if self.conn is None:
+            return
+        try:
+            if dirty:
+                self.conn.executemany(
+                    "INSERT INTO queries (track_key, spotify_url, source_url, created, last_used) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (track_key) DO UPDATE SET spotify_url = excluded.spotify_url, "
+                    "source_url = excluded.source_url, created = excluded.created, last_used = excluded.last_used",
+                    dirty
+                )
+            if invalid:
+                self.conn.executemany("DELETE FROM queries WHERE track_key = ?", invalid)
+            self.conn.commit()
+        except sqlite3.Error as e:
+            # e.g. locked by another instance for longer than the timeout; these updates are lost
+            print(f"Could not save query cache: {e}")
+            with contextlib.suppress(sqlite3.Error):
+                self.conn.rollback()
+
+    def close(self):
+        self.flush()
+        if self.conn is None:
+            return
+        try:
+            self.conn.execute("DELETE FROM queries WHERE created < ?", (time.time() - QUERY_CACHE_TTL_SECONDS,))
+            self.conn.execute(
+                "DELETE FROM queries WHERE track_key IN "
+                "(SELECT track_key FROM queries ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (QUERY_CACHE_MAX_ENTRIES,)
+            )
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"Could not prune query cache: {e}")
+        self._disconnect()
+
+# ------------------ Metrics ------------------
+class Histogram:
+    """
+    Fixed-bucket latency histogram; quantiles are interpolated within a bucket.
+    """
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = LATENCY_BUCKETS[i - 1] if i else 0.0
+                upper = LATENCY_BUCKETS[i]
+                if upper == float("inf"):
+                    return self.max
+                return min(lower + (upper - lower) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+class RunMetrics:
+    """
+    Per-run telemetry: outcome and error-class counters, queue wait / spawn /
+    runtime / transcode / verify histograms and rolling throughput. Fed by the coordinator, read by
+    the stats panel and exported as JSON and Prometheus text.
+    """
+    PHASES = ("queue_wait", "spawn", "runtime", "transcode_wait", "transcode", "verify")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.outcomes = {}
+        self.error_classes = {}
+        self.histograms = {phase: Histogram() for phase in self.PHASES}
+        self._finished_at = deque() # Monotonic completion times inside THROUGHPUT_WINDOW_SECONDS
+        self.finished = 0
+        self.query_cache = {"hits": 0, "misses": 0}
+
+    def record(self, item: dict, outcome: str):
+        now = time.monotonic()
+        with self._lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            if not item["success"] and not item["skipped"]:
+                error_class = "timeout" if item.get("timed_out") else item.get("error_class") or "unknown"
+                self.error_classes[error_class] = self.error_classes.get(error_class, 0) + 1
+            # Only tracks that actually ran spotdl have meaningful timings
+            if outcome in ("downloaded", "failed", "retried"):
+                self.histograms["queue_wait"].observe(item.get("queue_wait", 0.0))
+                self.histograms["spawn"].observe(item.get("spawn", 0.0))
+                self.histograms["runtime"].observe(item.get("duration") or 0.0)
+                for phase in ("transcode_wait", "transcode", "verify"): # Only with those stages on
+                    if phase in item:
+                        self.histograms[phase].observe(item[phase])
+            if outcome not in ("retried", "stopped"):
+                self.finished += 1
+                self._finished_at.append(now)
+
+    def record_cache(self, hit: bool):
+        with self._lock:
+            self.query_cache["hits" if hit else "misses"] += 1
+
+    def _throughput(self, now: float) -> float:
+        while self._finished_at and now - self._finished_at[0] > THROUGHPUT_WINDOW_SECONDS:
+            self._finished_at.popleft()
+        return len(self._finished_at) / min(THROUGHPUT_WINDOW_SECONDS, max(now - self.started, 1e-9))
+
+    def summary(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            elapsed = now - self.started
+            return {
+                "elapsed_seconds": round(elapsed, 3),
+                "tracks_finished": self.finished,
+                "throughput_tracks_per_second": round(self._throughput(now), 3),
+                "overall_tracks_per_second": round(self.finished / elapsed, 3) if elapsed > 0 else 0.0,
+                "outcomes": dict(self.outcomes),
+                "error_classes": dict(self.error_classes),
+                "query_cache": dict(self.query_cache),
+                "latency_seconds": {phase: self._latency_summary(h) for phase, h in self.histograms.items()},
+            }
+
+    @staticmethod
+    def _latency_summary(h: Histogram) -> dict:
+        return {"count": h.count, "mean": round(h.sum / h.count, 3) if h.count else 0.0,
+                "p50": round(h.quantile(0.5), 3), "p95": round(h.quantile(0.95), 3),
+                "p99": round(h.quantile(0.99), 3),
+                # Raw buckets so summaries of several shards can be merged
+                "sum": round(h.sum, 3), "max": round(h.max, 3), "buckets": list(h.counts)}
+
+    @classmethod
+    def merge_summaries(cls, summaries: list) -> dict:
+        """
+        Combines the JSON summaries of several shards into one.
+        """
+        merged = {"shards": len(summaries), "tracks_finished": 0, "outcomes": {}, "error_classes": {}, "query_cache": {}}
+        histograms = {phase: Histogram() for phase in cls.PHASES}
+        for summary in summaries:
+            merged["tracks_finished"] += summary.get("tracks_finished", 0)
+            for field in ("outcomes", "error_classes", "query_cache"):
+                for k, v in summary.get(field, {}).items():
+                    merged[field][k] = merged[field].get(k, 0) + v
+            for phase, data in summary.get("latency_seconds", {}).items():
+                h = histograms.get(phase)
+                if h is None or len(data.get("buckets", [])) != len(h.counts):
+                    continue
+                h.counts = [a + b for a, b in zip(h.counts, data["buckets"])]
+                h.count += data["count"]
+                h.sum += data["sum"]
+                h.max = max(h.max, data["max"])
+        # Shards run side by side, so the slowest one bounds the wall-clock time
+        elapsed = max((summary.get("elapsed_seconds", 0) for summary in summaries), default=0)
+        merged["elapsed_seconds"] = elapsed
+        merged["overall_tracks_per_second"] = round(merged["tracks_finished"] / elapsed, 3) if elapsed else 0.0
+        merged["latency_seconds"] = {phase: cls._latency_summary(h) for phase, h in histograms.items()}
+        return merged
+
+    def prometheus_text(self) -> str:
+        summary = self.summary()
+        lines = ["# TYPE spdl_tracks_total counter"]
+        lines += [f'spdl_tracks_total{{outcome="{k}"}} {v}' for k, v in sorted(summary["outcomes"].items())]
+        lines.append("# TYPE spdl_errors_total counter")
+        lines += [f'spdl_errors_total{{class="{k}"}} {v}' for k, v in sorted(summary["error_classes"].items())]
+        lines.append("# TYPE spdl_query_cache_lookups_total counter")
+        lines += [f'spdl_query_cache_lookups_total{{result="{k}"}} {v}' for k, v in sorted(summary["query_cache"].items())]
+        lines.append("# TYPE spdl_throughput_tracks_per_second gauge")
+        lines.append(f"spdl_throughput_tracks_per_second {summary['throughput_tracks_per_second']}")
+        lines.append("# TYPE spdl_track_seconds histogram")
+        with self._lock:
+            for phase, h in self.histograms.items():
+                cumulative = 0
+                for bound, n in zip(LATENCY_BUCKETS, h.counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else bound
+                    lines.append(f'spdl_track_seconds_bucket{{phase="{phase}",le="{le}"}} {cumulative}')
+                lines.append(f'spdl_track_seconds_sum{{phase="{phase}"}} {h.sum:.3f}')
+                lines.append(f'spdl_track_seconds_count{{phase="{phase}"}} {h.count}')
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _write_atomic(path: Path, text: str):
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def write_json(self, path: Path):
+        self._write_atomic(path, json.dumps(self.summary(), indent=2))
+
+    def write_prometheus(self, path: Path):
+        self._write_atomic(path, self.prometheus_text())
+
+# ------------------ Failure Log ------------------
+class FailureLog:
+    """
+    Single writer for failed tracks. Callers put() records on a queue; one thread
+    appends them in batches to a JSON Lines log and to a CSV in the input schema,
+    so the failures of a run can be fed straight back through load_csv.
+    """
+    def __init__(self, log_path: Path, csv_path: Path):
+        self.log_path = log_path
+        self.csv_path = csv_path
+        self.count = 0
+        self._queue = Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, result: dict):
+        track = result["track"]
+        self.count += 1
+        self._queue.put({
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "track": {"title": track.title, "artist": track.artist,
+                      "playlist": track.playlist, "spotify_id": track.spotify_id,
+                      "duration_ms": round(track.duration * 1000) if track.duration else ""},
+            "query": result.get("query", ""),
+            "attempt": result.get("attempt", 1),
+            "exit_code": result.get("exit_code"),
+            "duration": round(result.get("duration") or 0.0, 3),
+            "error_class": result.get("error_class", ""),
+            "error": result.get("error", ""),
+            "output_tail": result.get("output", ""),
+        })
+
+    def _run(self):
+        log_file = csv_file = writer = None
+        done = False
+        while not done:
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=FAILURE_LOG_FLUSH_SECONDS))
+                while len(batch) < FAILURE_LOG_BATCH:
+                    batch.append(self._queue.get_nowait())
+            except Empty:
+                pass
+            if None in batch:
+                done = True
+                batch = [record for record in batch if record is not None]
+            if not batch:
+                continue
+            try:
+                if log_file is None:
+                    # Files are only created once something actually failed
+                    log_file = open(self.log_path, "a", encoding="utf-8")
+                    csv_file = open(self.csv_path, "w", encoding="utf-8", newline="")
+                    writer = csv.writer(csv_file)
+                    writer.writerow(CSV_FIELDS)
+                log_file.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in batch)
+                writer.writerows([record["track"]["title"], record["track"]["artist"],
+                                  record["track"]["playlist"], record["track"]["spotify_id"],
+                                  record["track"]["duration_ms"]]
+                                 for record in batch)
+                log_file.flush()
+                csv_file.flush()
+            except OSError as e:
+                print(f"Error writing failure log: {e}")
+        for f in (log_file, csv_file):
+            if f:
+                f.close()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+# ------------------ Library Index ------------------
+class LibraryIndex:
+    """
+    In-memory index of the audio files already in the output library, mapping
+    each playlist folder to the normalized "artist - title" stems found there.
+    Cached on disk and refreshed only for folders whose mtime changed.
+    """
+    def __init__(self, root: Path):
+        self.root = root
+        self.cache_path = root / LIBRARY_INDEX_FILE_NAME
+        self.folders = {} # folder name -> {"mtime_ns": int, "stems": set}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, root: Path) -> "LibraryIndex":
+        index = cls(root)
+        index._load_cache()
+        index.refresh()
+        index.save()
+        return index
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            self.folders = {name: {"mtime_ns": entry["mtime_ns"], "stems": set(entry["stems"])}
+                            for name, entry in cached.get("folders", {}).items()}
+        except (OSError, ValueError, KeyError, TypeError):
+            self.folders = {}
+
+    @staticmethod
+    def _scan_folder(folder: Path) -> set:
+        stems = set()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                stem, ext = os.path.splitext(entry.name)
+                if ext.lower() in AUDIO_EXTENSIONS and entry.is_file():
+                    stems.update(file_name_variants(stem))
+        return stems
+
+    def refresh(self):
+        """
+        Walks the root once, rescanning only folders that are new or changed.
+        """
+        seen = set()
+        try:
+            entries = list(os.scandir(self.root))
+        except OSError:
+            entries = []
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            seen.add(entry.name)
+            mtime_ns = entry.stat().st_mtime_ns
+            cached = self.folders.get(entry.name)
+            if cached is None or cached["mtime_ns"] != mtime_ns:
+                try:
+                    stems = self._scan_folder(Path(entry.path))
+                except OSError:
+                    continue
+                with self._lock:
+                    self.folders[entry.name] = {"mtime_ns": mtime_ns, "stems": stems}
+        with self._lock:
+            for name in set(self.folders) - seen:
+                del self.folders[name]
+
+    def save(self):
+        with self._lock:
+            data = {"folders": {name: {"mtime_ns": entry["mtime_ns"], "stems": sorted(entry["stems"])}
+                                for name, entry in self.folders.items()}}
+        tmp_path = self.cache_path.with_suffix(f".{os.getpid()}.tmp") # Instances may share the folder
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"Could not save library index: {e}")
+
+    def contains(self, folder_name: str, track: Track) -> bool:
+        variants = name_variants(track.artist, track.title)
+        with self._lock:
+            entry = self.folders.get(folder_name)
+            return entry is not None and not variants.isdisjoint(entry["stems"])
+
+    @staticmethod
+    def locate(folder: Path, track: Track):
+        """
+        Returns the audio file in folder that matches track, or None.
+        """
+        variants = name_variants(track.artist, track.title)
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    stem, ext = os.path.splitext(entry.name)
+                    if ext.lower() in AUDIO_EXTENSIONS and not variants.isdisjoint(file_name_variants(stem)):
+                        return Path(entry.path)
+        except OSError:
+            pass
+        return None
+
+    def add(self, folder_name: str, track: Track):
+        variants = name_variants(track.artist, track.title)
+        with self._lock:
+            # mtime -1 forces a rescan of this folder on the next refresh
+            entry = self.folders.setdefault(folder_name, {"mtime_ns": -1, "stems": set()})
+            entry["mtime_ns"] = -1
+            entry["stems"].update(variants)
+
+# ------------------ Leases ------------------
+class LeaseManager:
+    """
+    Claims on output files shared by several instances (e.g. shards writing to
+    one NAS). A lease is a lock file created atomically with O_EXCL, renewed
+    while held and taken over once it has gone LEASE_TTL_SECONDS without renewal.
+    Acquiring is re-entrant; the file is removed when the last holder releases.
+    """
+    def __init__(self, root_out: Path):
+        self.folder = root_out / LEASE_DIR_NAME
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._held = {} # lease path -> hold count
+        self._stop = threading.Event()
+        self._renewer = threading.Thread(target=self._renew, daemon=True)
+        self._renewer.start()
+
+    def _path(self, track: Track) -> Path:
+        # One lease per output file: the same song in two playlists is two files
+        name = hashlib.blake2b(f"{track.playlist}\0{track_key(track)}".encode("utf-8"), digest_size=16).hexdigest()
+        return self.folder / f"{name}.lease"
+
+    def _create(self, path: Path) -> bool:
+        flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY
+        try:
+            fd = os.open(path, flags)
+        except FileExistsError:
+            return False
+        except FileNotFoundError:
+            # Another instance's empty-folder cleanup may have removed the lease folder
+            self.folder.mkdir(parents=True, exist_ok=True)
+            try:
+                fd = os.open(path, flags)
+            except FileExistsError:
+                return False
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(self.owner)
+        return True
+
+    def acquire(self, track: Track) -> bool:
+        """
+        Returns True if this instance now holds the lease for track.
+        """
+        path = self._path(track)
+        with self._lock:
+            if path in self._held:
+                self._held[path] += 1
+                return True
+        if not self._create(path):
+            try:
+                if time.time() - path.stat().st_mtime < LEASE_TTL_SECONDS:
+                    return False
+                # Abandoned: move it aside first so only one instance can take it over
+                stale = path.with_name(f"{path.name}.{self.owner.replace(':', '_')}.stale")
+                os.rename(path, stale)
+                if time.time() - stale.stat().st_mtime < LEASE_TTL_SECONDS:
+                    # Replaced by a fresh lease after our stat(); put it back unless yet another one exists
+                    with contextlib.suppress(OSError):
+                        os.link(stale, path)
+                    stale.unlink()
+                    return False
+                stale.unlink()
+            except FileNotFoundError:
+                pass # Released or taken over meanwhile; race for a fresh one
+            except OSError:
+                return False
+            if not self._create(path):
+                return False
+        with self._lock:
+            self._held[path] = 1
+        return True
+
+    def release(self, track: Track):
+        path = self._path(track)
+        with self._lock:
+            count = self._held.get(path, 0) - 1
+            if count > 0:
+                self._held[path] = count
+                return
+            if self._held.pop(path, None) is None:
+                return
+        with contextlib.suppress(OSError):
+            # Don't remove a lease another instance took over after ours expired
+            if path.read_text(encoding="utf-8") == self.owner:
+                path.unlink()
+
+    def _renew(self):
+        while not self._stop.wait(LEASE_RENEW_SECONDS):
+            with self._lock:
+                paths = list(self._held)
+            for path in paths:
+                with contextlib.suppress(OSError):
+                    os.utime(path)
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            paths, self._held = list(self._held), {}
+        for path in paths:
+            with contextlib.suppress(OSError):
+                if path.read_text(encoding="utf-8") == self.owner:
+                    path.unlink()
+
+# ------------------ Process Registry ------------------
+class ProcessRegistry:
+    """
+    Every child process currently running for a download. Stop and close use it
+    to terminate, then kill, whole process groups instead of waiting for them.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._procs = set()
+        self._closed = False
+
+    def reopen(self):
+        with self._lock:
+            self._closed = False
+
+    def add(self, proc):
+        with self._lock:
+            if not self._closed:
+                self._procs.add(proc)
+                return
+        # Spawned after a stop: don't let it run
+        signal_process_group(proc, kill=True)
+
+    def discard(self, proc):
+        with self._lock:
+            self._procs.discard(proc)
+
+    @staticmethod
+    def _running(proc) -> bool:
+        return (proc.poll() if hasattr(proc, "poll") else proc.returncode) is None
+
+    def terminate_all(self, grace: float = STOP_GRACE_SECONDS):
+        with self._lock:
+            self._closed = True
+            procs = list(self._procs)
+        for proc in procs:
+            signal_process_group(proc)
+        deadline = time.monotonic() + grace
+        while time.monotonic() < deadline and any(self._running(proc) for proc in procs):
+            time.sleep(0.05)
+        for proc in procs:
+            if self._running(proc):
+                signal_process_group(proc, kill=True)
+
+# ------------------ Warm Workers ------------------
+class WarmWorker:
+    """
+    A long-lived spotdl helper process (spdl_worker.py) that imports spotdl once
+    and serves jobs as JSON lines over its stdin/stdout.
+    """
+    def __init__(self, module: str = WARM_WORKER_MODULE, registry: ProcessRegistry = None,
+                 audio_format: str = OUTPUT_FORMAT, native: bool = False):
+        self.proc = subprocess.Popen(
+            [sys.executable, str(WARM_WORKER_SCRIPT), "--module", module, "--format", audio_format,
+             *(["--bitrate", "disable"] if native else [])],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            encoding="utf-8",
+            bufsize=1,
+            **process_group_kwargs()
+        )
+        self.registry = registry
+        if registry:
+            registry.add(self.proc)
+        self._ids = itertools.count(1)
+        hello = self._read_reply(WARM_WORKER_STARTUP_TIMEOUT)
+        if not hello.get("ready"):
+            self.close()
+            raise RuntimeError(f"Warm worker failed to start: {hello.get('error', 'unknown error')}")
+
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def _read_reply(self, timeout: float) -> dict:
+        # readline() has no timeout, so a watchdog kills the helper if it hangs
+        timed_out = threading.Event()
+        def expire():
+            timed_out.set()
+            signal_process_group(self.proc, kill=True) # Its ffmpeg/yt-dlp children too
+        watchdog = threading.Timer(timeout, expire)
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            line = self.proc.stdout.readline()
+        finally:
+            watchdog.cancel()
+
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(self.proc.args, timeout)
+        if not line:
+            raise RuntimeError(f"Warm worker exited (code {self.proc.poll()})")
+        return json.loads(line)
+
+    def run(self, query: str, out_folder: str, timeout: float = DOWNLOAD_TIMEOUT) -> dict:
+        job = {"id": next(self._ids), "query": query, "output": out_folder}
+        try:
+            self.proc.stdin.write(json.dumps(job) + "\n")
+            self.proc.stdin.flush()
+        except OSError as e:
+            raise RuntimeError(f"Warm worker pipe closed: {e}")
+        return self._read_reply(timeout)
+
+    def close(self):
+        with contextlib.suppress(Exception):
+            self.proc.stdin.close()
+        with contextlib.suppress(Exception):
+            self.proc.wait(timeout=2)
+        if self.alive():
+            signal_process_group(self.proc, kill=True)
+        if self.registry:
+            self.registry.discard(self.proc)
+
+
+class WarmWorkerPool:
+    """
+    A fixed-size pool of WarmWorker processes. Helpers are started lazily on
+    first use, and a helper that crashed or timed out is respawned on its next lease.
+    Idle helpers are reused most-recently-returned first, and helpers beyond limit
+    (the auto concurrency limit, at most size) are closed when they come back.
+    """
+    def __init__(self, size: int, module: str = WARM_WORKER_MODULE, registry: ProcessRegistry = None,
+                 native: bool = False):
+        self.size = size
+        self.limit = size
+        self.module = module
+        self.registry = registry
+        self.native = native # Fetch NATIVE_FORMAT without re-encoding, for the post-processing stage
+        self._idle = LifoQueue() # Warm helpers sit on top of the unspawned placeholders
+        for _ in range(size):
+            self._idle.put(None) # Placeholder until the slot's helper is spawned
+        self._live = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @contextlib.contextmanager
+    def lease(self):
+        worker = self._idle.get()
+        try:
+            if worker is not None and not worker.alive():
+                worker.close()
+                worker = None
+                with self._lock:
+                    self._live -= 1
+            if worker is None:
+                worker = WarmWorker(self.module, self.registry, NATIVE_FORMAT if self.native else OUTPUT_FORMAT,
+                                    self.native)
+                with self._lock:
+                    self._live += 1
+            yield worker
+        finally:
+            if worker is not None:
+                with self._lock:
+                    retire = self._closed or not worker.alive() or self._live > self.limit
+                    if retire:
+                        self._live -= 1
+                if retire:
+                    worker.close()
+                    worker = None
+            self._idle.put(worker)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except Empty:
+                break
+            if worker is not None:
+                worker.close()
+
+# ------------------ Asyncio Engine ------------------
+class AsyncioEngine:
+    """
+    Executor-like engine that runs download coroutines on one background event
+    loop, with a semaphore bounding how many run at once. In-flight downloads
+    cost a coroutine and a child process instead of an OS thread each.
+    """
+    def __init__(self, max_workers: int):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="asyncio-engine", daemon=True)
+        self.thread.start()
+        self.semaphore = asyncio.Semaphore(max_workers)
+
+    async def _guarded(self, coro_fn, *args):
+        async with self.semaphore:
+            return await coro_fn(*args)
+
+    def submit(self, coro_fn, *args) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(self._guarded(coro_fn, *args), self.loop)
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False):
+        async def drain():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            if cancel_futures:
+                for task in tasks:
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        done = asyncio.run_coroutine_threadsafe(drain(), self.loop)
+        done.add_done_callback(lambda _: self.loop.call_soon_threadsafe(self.loop.stop))
+        if wait:
+            self.thread.join()
+            self.loop.close()
+
+def delete_empty_folders(root_out: Path):
+    """
+    Removes empty playlist folders directly under root_out.
+    """
+    try:
+        for f in root_out.iterdir():
+            # Dot-folders are bookkeeping shared with other instances (e.g. leases)
+            if f.is_dir() and not f.name.startswith(".") and not any(f.iterdir()):
+                f.rmdir()
+    except Exception as e:
+        print(f"Error deleting empty folder: {e}")
+
+# ------------------ Download Session ------------------
+class DownloadSession:
+    """
+    One download job and everything it needs while running. Used directly by the
+    command line and benchmarks; the GUI is a DownloadSession with a window.
+    """
+    def __init__(self):
+        self.progress = ProgressState()
+        self.track_tasks = iter(())
+        self.stop_flag = threading.Event()
+        self.log_file_path = None
+        self.stats_file_path = None
+        self.metrics = None
+        self.submitted = {}
+        self.failed_csv_path = None
+        self.failure_log = None
+
+        # Concurrency management
+        self.executor = None
+        self.active_futures = set()
+        self.streamed_tracks = 0
+        self.engine = ENGINES[0]
+        self.scheduler = next(iter(SCHEDULERS))
+        self.delete_empty = False # Remove a playlist's folder as soon as it finishes empty
+        self.batch_size = DEFAULT_BATCH_SIZE
+        self.auto_concurrency = False
+        self.rate_limit = RATE_LIMIT_PER_SECOND
+        self.rate_burst = RATE_LIMIT_BURST
+        self.limiter = None
+        self.warm_pool = None
+        self.library_index = None
+        self.retries = None
+        self.attempts = {}
+        self.cache_counted = set()
+        self.manifest = None
+        self.controller = None
+        self.duplicates = None
+        self.fallback_tasks = deque()
+
+        # Optional CPU stage: network workers fetch native audio, ffmpeg converts it on its own pool
+        self.postprocess = False
+        self.loudnorm = False
+        self.post_executor = None
+        self.post_futures = {} # Future -> the download result it converts
+
+        # Finished files are checked on a process pool before they count as downloaded
+        self.verify = True
+        self.verify_executor = None
+        self.verify_futures = {} # Future -> the download result whose file it checks
+
+        # Search results of earlier runs, and where spotdl writes this run's ones
+        self.query_cache = None
+        self.resolve_dir = None
+
+        # Multi-instance runs: this instance's (index, count) partition, and optional leases
+        self.shard = None
+        self.use_leases = False
+        self.resuming = False # Continue the folder's last job instead of starting a new one
+        self.leases = None
+
+        # Child processes, so Stop/close can kill them immediately
+        self.processes = ProcessRegistry()
+        self.touched_folders = set()
+        self.interrupted = []
+
+    def prepare(self, tasks, total: int):
+        """
+        Resets per-run state for a new job streaming tasks (an iterable of Track).
+        """
+        self.track_tasks = iter(tasks)
+        self.stop_flag.clear()
+        self.active_futures.clear()
+        self.processes.reopen()
+        self.touched_folders.clear()
+        self.interrupted.clear()
+        self.progress = ProgressState(total)
+
+    def close(self):
+        """
+        Stops everything right away; used when the process is about to exit.
+        """
+        self.stop_flag.set()
+        self.processes.terminate_all()
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.post_executor:
+            self.post_executor.shutdown(wait=False, cancel_futures=True)
+        if self.verify_executor:
+            self.verify_executor.shutdown(wait=False, cancel_futures=True)
+        if self.warm_pool:
+            self.warm_pool.close()
+
+    def request_stop(self):
+        self.stop_flag.set()
+        # Kill running spotdl process groups right away instead of waiting for them
+        threading.Thread(target=self.processes.terminate_all, daemon=True).start()
+        self.progress.set_status("Stopping downloads...")
+
+    def _resolve_links(self, links: list):
+        """
+        Yields the tracks of every link, resolving several links in parallel.
+        A link that can't be expanded falls back to a single spotdl task.
+        """
+        resolved = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=RESOLVE_WORKERS) as pool:
+            futures = [pool.submit(resolve_spotify_link, link, registry=self.processes) for link in links]
+            for finished, (link, future) in enumerate(zip(links, futures), start=1):
+                if self.stop_flag.is_set():
+                    for pending in futures:
+                        pending.cancel()
+                    return
+                try:
+                    tracks = future.result()
+                except Exception as e:
+                    # Falls back to downloading the link itself, whose failure is logged as usual
+                    self.progress.set_status(f"Could not expand {link}: {self._describe_failure(e)}")
+                    tracks = [Track(title=link, playlist="Playlist")]
+                resolved += len(tracks)
+                self.progress.set_total(resolved + len(links) - finished)
+                yield from tracks
+
+    def load_csv(self, path):
+        """
+        Yields one Track per CSV row without materializing the file.
+        """
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            # Try to infer if header is present
+            try:
+                # Read the first chunk to detect dialect and header
+                first_lines = "".join(f.readline() for _ in range(5))
+                f.seek(0)
+
+                if 'Track name' in first_lines or 'track name' in first_lines:
+                    reader = csv.DictReader(f)
+                else:
+                    # Assume no header, just a list of queries/links
+                    reader = csv.reader(f)
+
+            except Exception:
+                f.seek(0)
+                reader = csv.reader(f) # Fallback to simple reader
+
+            if isinstance(reader, csv.DictReader):
+                for row in reader:
+                    yield Track(
+                        title=row.get("Track name") or row.get("track name") or "",
+                        artist=row.get("Artist name") or row.get("artist name") or "",
+                        playlist=row.get("Playlist name") or row.get("playlist name") or "Default",
+                        spotify_id=row.get("Spotify - id") or row.get("spotify - id") or "",
+                        duration=parse_duration_ms(row.get("Duration (ms)") or row.get("Track Duration (ms)"))
+                    )
+            else:
+                for row in reader:
+                    query = row[0].strip() if row else ""
+                    if query:
+                        # Treat the entire line as the spotDL query
+                        yield Track(title=query)
+
+    def _build_query(self, track: Track) -> str:
+        """
+        Uses the Spotify ID when present, otherwise a clean "artist - title" query.
+        """
+        if track.spotify_id and track.spotify_id != "null":
+            return f"https://open.spotify.com/track/{track.spotify_id}"
+        return f"{track.artist} - {track.title}" if track.artist else track.title
+
+    def _resolve_query(self, track: Track) -> tuple:
+        """
+        Returns (query, cached): the "source_url|spotify_url" a previous run resolved
+        track to when the query cache has it, otherwise _build_query's search query.
+        """
+        cached = self.query_cache.lookup(track) if self.query_cache else None
+        if self.query_cache and id(track) not in self.cache_counted:
+            # Split batches and retries look the same track up again; it counts once
+            self.cache_counted.add(id(track))
+            self.metrics.record_cache(cached is not None)
+        return cached or self._build_query(track), cached is not None
+
+    def _save_file(self, key) -> Path:
+        """
+        Where spotdl writes the songs it resolved for the work unit with this key.
+        """
+        return Path(self.resolve_dir) / f"{key}.spotdl" if self.resolve_dir else None
+
+    def _learn_resolutions(self, tracks: list, save_file: Path):
+        """
+        Caches the Spotify and audio source URLs spotdl saved for tracks.
+        """
+        if not self.query_cache or save_file is None:
+            return
+        try:
+            with open(save_file, "r", encoding="utf-8") as f:
+                songs = json.load(f)
+        except (OSError, ValueError):
+            return # All hits, or spotdl didn't get as far as saving
+        finally:
+            with contextlib.suppress(OSError):
+                save_file.unlink()
+
+        if len(tracks) == 1 and len(songs) == 1:
+            pairs = [(tracks[0], songs[0])]
+        else:
+            # Batches: pair songs with tracks by name, since spotdl may reorder or drop them
+            by_name = {}
+            for song in songs:
+                for variant in name_variants(", ".join(song.get("artists") or []), song.get("name") or ""):
+                    by_name.setdefault(variant, song)
+            pairs = []
+            for track in tracks:
+                song = next((by_name[v] for v in name_variants(track.artist, track.title) if v in by_name), None)
+                if song:
+                    pairs.append((track, song))
+        for track, song in pairs:
+            if song.get("url") and song.get("download_url"):
+                self.query_cache.store(track, song["url"], song["download_url"])
+
+    def _build_command(self, queries: list, out_folder: str, save_file: Path = None) -> list:
+        # NOTE: spotdl handles the output template, we just pass the folder
+        return [
+            SPOTDL_CMD,
+            *queries,
+            # Records what each query resolved to, for the query cache
+            *(["--save-file", str(save_file)] if save_file else []),
+            "--output", out_folder,
+            # With post-processing on, conversion happens later on the CPU pool
+            *(["--format", NATIVE_FORMAT, "--bitrate", "disable"] if self.postprocess else ["--format", OUTPUT_FORMAT]),
+            "--overwrite", "skip",
+            "--simple-tui",
+            "--log-level", "INFO" # Per-track status lines are parsed for live progress
+        ]
+
+    def _playlist_folder(self, track: Track, root_out: Path) -> Path:
+        playlist_folder = root_out / sanitize_for_filesystem(track.playlist)
+        playlist_folder.mkdir(parents=True, exist_ok=True)
+        self.touched_folders.add(playlist_folder)
+        return playlist_folder
+
+    def _already_present(self, track: Track) -> bool:
+        folder_name = sanitize_for_filesystem(track.playlist)
+        return self.library_index is not None and self.library_index.contains(folder_name, track)
+
+    def _present_result(self, track: Track) -> dict:
+        return {"track": track, "success": True, "skipped": False, "present": True, "duration": 0.0, "error": ""}
+
+    def _prepare_track(self, track: Track, root_out: Path):
+        """
+        Shared set-up for a single track. Returns (early_result, query, out_folder, cmd);
+        early_result is set when the track must not reach spotdl.
+        """
+        if self.stop_flag.is_set():
+            return {"track": track, "success": False, "skipped": True}, None, None, None
+
+        # Tracks already in the library never reach spotdl
+        if self._already_present(track):
+            return self._present_result(track), None, None, None
+        claim = self._claim(track, root_out)
+        if claim:
+            return claim, None, None, None
+
+        out_folder = str(self._playlist_folder(track, root_out))
+        query, cached = self._resolve_query(track)
+        cmd = self._build_command([query], out_folder, None if cached else self._save_file(id(track)))
+        self.progress.track_started(id(track), f"{track.artist} — {track.title}")
+        return None, query, out_folder, cmd
+
+    def _claim(self, track: Track, root_out: Path):
+        """
+        Takes the lease on track's output file when leases are on. Returns None when
+        this instance should download it, otherwise the result to report instead.
+        """
+        if not self.leases:
+            return None
+        try:
+            acquired = self.leases.acquire(track)
+        except OSError as e:
+            # e.g. the shared folder went away; a normal failure keeps duplicates and the manifest moving
+            return {"track": track, "success": False, "skipped": False, "duration": 0.0, "query": "",
+                    "error": f"Could not claim lease: {e}", "error_class": "transient", "output": ""}
+        if not acquired:
+            return {"track": track, "success": True, "skipped": False, "elsewhere": True,
+                    "duration": 0.0, "error": ""}
+        # Another instance may have finished it after our index was built
+        if self.library_index.locate(self._playlist_folder(track, root_out), track):
+            self.leases.release(track)
+            return self._present_result(track)
+        return None
+
+    def _throttle(self, key, cost: int = 1) -> float:
+        """
+        Waits for the rate limiter before a spawn and returns the seconds waited,
+        or None if Stop came first.
+        """
+        started = time.monotonic()
+        ticket = self.limiter.reserve(cost) if self.limiter else 0.0
+        # Short waits that re-check the bucket, so a penalty or its end applies to waiting starts
+        while self.limiter and (delay := self.limiter.delay(ticket)) > 0:
+            self.progress.track_progress(key, "rate limited")
+            if self.stop_flag.wait(min(delay, RATE_LIMIT_RECHECK_SECONDS)):
+                return None
+        return None if self.stop_flag.is_set() else time.monotonic() - started
+
+    def _queue_wait(self, unit) -> float:
+        """
+        Seconds unit spent between submission and a worker picking it up.
+        """
+        submitted = self.submitted.pop(id(unit), None)
+        return time.monotonic() - submitted if submitted is not None else 0.0
+
+    def _progress_listener(self, key):
+        """
+        Returns an on_line callback that turns spotdl output into progress events for key.
+        """
+        def on_line(line: str):
+            event = parse_progress_line(line)
+            if event:
+                self.progress.track_progress(key, *event)
+        return on_line
+
+    def _describe_failure(self, error: Exception) -> str:
+        if isinstance(error, DownloadStalled):
+            return f"No output for {STALL_TIMEOUT_SECONDS}s; download looked stuck."
+        if isinstance(error, subprocess.TimeoutExpired):
+            return f"Timeout ({DOWNLOAD_TIMEOUT}s) occurred."
+        if isinstance(error, subprocess.CalledProcessError):
+            # The output tail goes to the failure log separately; keep its last line here
+            lines = str(error.stderr or "").strip().splitlines()
+            return f"spotdl failed (Exit Code {error.returncode}). {lines[-1] if lines else ''}".rstrip()
+        return f"Download process failed: {error}"
+
+    def _finish_track(self, track: Track, query: str, error, started: float, timings: dict) -> dict:
+        """
+        Builds the result dict for a finished track; error is the exception raised, or None.
+        timings carries the queue wait and spawn time measured on the way.
+        """
+        self.progress.track_finished(id(track))
+        if self.leases:
+            self.leases.release(track)
+        if error and self.stop_flag.is_set():
+            self._note_interrupted([track], started)
+        error_class = classify_failure(error) if error else ""
+        return {"track": track, "success": error is None, "skipped": self.stop_flag.is_set(),
+                "duration": time.monotonic() - started, "query": query,
+                "error": self._describe_failure(error) if error else "",
+                "exit_code": getattr(error, "returncode", None),
+                "output": str(getattr(error, "stderr", None) or getattr(error, "output", None) or ""),
+                "error_class": error_class,
+                # spotdl itself gave up on the query, e.g. "No results found"
+                "rejected": error_class == "permanent" and isinstance(error, subprocess.CalledProcessError),
+                "timed_out": isinstance(error, subprocess.TimeoutExpired), **timings}
+
+    def _download_single_track(self, track: Track, root_out: Path) -> dict:
+        """
+        Executes the spotdl command for a single track. Runs on a worker thread.
+        """
+        timings = {"queue_wait": self._queue_wait(track), "spawn": 0.0}
+        early, query, out_folder, cmd = self._prepare_track(track, root_out)
+        if early:
+            return early
+        throttled = self._throttle(id(track))
+        if throttled is None:
+            self._finish_track(track, query, None, time.monotonic(), timings) # Releases the row and lease
+            return {"track": track, "success": False, "skipped": True}
+        timings["queue_wait"] += throttled
+
+        error = None
+        started = time.monotonic()
+        try:
+            if self.engine == "Warm workers":
+                with self.warm_pool.lease() as worker:
+                    timings["spawn"] = time.monotonic() - started # Waiting for (or starting) a helper
+                    reply = worker.run(query, out_folder)
+                if not reply["success"]:
+                    raise subprocess.CalledProcessError(1, query, stderr=f"Warm worker: {reply['error']}")
+                if self.query_cache and reply.get("url") and reply.get("download_url"):
+                    self.query_cache.store(track, reply["url"], reply["download_url"])
+            else:
+                # Raises CalledProcessError if return code is non-zero
+                run_tracked(cmd, DOWNLOAD_TIMEOUT, self.processes,
+                            self._progress_listener(id(track)), STALL_TIMEOUT_SECONDS, timings)
+                self._learn_resolutions([track], self._save_file(id(track)))
+
+        except Exception as e:
+            error = e
+
+        return self._finish_track(track, query, error, started, timings)
+
+    async def _download_single_track_async(self, track: Track, root_out: Path) -> dict:
+        """
+        Asyncio counterpart of _download_single_track. Runs on the AsyncioEngine loop.
+        """
+        timings = {"queue_wait": self._queue_wait(track), "spawn": 0.0}
+        early, query, out_folder, cmd = self._prepare_track(track, root_out)
+        if early:
+            return early
+        waiting = time.monotonic()
+        ticket = self.limiter.reserve() if self.limiter else 0.0
+        while self.limiter and (delay := self.limiter.delay(ticket)) > 0:
+            self.progress.track_progress(id(track), "rate limited")
+            try:
+                await asyncio.sleep(min(delay, RATE_LIMIT_RECHECK_SECONDS))
+            except asyncio.CancelledError: # Stop
+                self._finish_track(track, query, None, time.monotonic(), timings)
+                raise
+        timings["queue_wait"] += time.monotonic() - waiting
+
+        error = None
+        started = time.monotonic()
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT, **process_group_kwargs()
+            )
+            timings["spawn"] = time.monotonic() - started
+            self.processes.add(proc)
+            on_line = self._progress_listener(id(track))
+            splitter = LineSplitter()
+            tail = deque(maxlen=OUTPUT_TAIL_LINES)
+            deadline = started + DOWNLOAD_TIMEOUT
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise subprocess.TimeoutExpired(cmd, DOWNLOAD_TIMEOUT, output="\n".join(tail))
+                    try:
+                        chunk = await asyncio.wait_for(proc.stdout.read(65536),
+                                                       min(remaining, STALL_TIMEOUT_SECONDS))
+                    except asyncio.TimeoutError:
+                        if remaining > STALL_TIMEOUT_SECONDS:
+                            raise DownloadStalled(cmd, STALL_TIMEOUT_SECONDS, output="\n".join(tail))
+                        continue
+                    lines = splitter.feed(chunk) if chunk else splitter.flush()
+                    for line in lines:
+                        tail.append(line)
+                        on_line(line)
+                    if not chunk:
+                        break
+                await proc.wait()
+            except (subprocess.TimeoutExpired, asyncio.CancelledError) as e:
+                signal_process_group(proc, kill=True)
+                await proc.wait()
+                if isinstance(e, asyncio.CancelledError):
+                    self._note_interrupted([track], started)
+                    if self.leases:
+                        self.leases.release(track)
+                raise
+            finally:
+                self.processes.discard(proc)
+            if proc.returncode != 0:
+                output = "\n".join(tail)
+                raise subprocess.CalledProcessError(proc.returncode, cmd, output, output)
+            self._learn_resolutions([track], self._save_file(id(track)))
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = e
+
+        return self._finish_track(track, query, error, started, timings)
+
+    def _download_batch(self, tracks: list, root_out: Path) -> list:
+        """
+        Executes one spotdl command for a chunk of tracks sharing a playlist folder.
+        A failed chunk is split in half and retried until the failing tracks are
+        isolated, so each track still gets its own result. Runs on a worker thread.
+        """
+        queue_wait = self._queue_wait(tracks) # Only the submitted chunk has one; halves add 0
+        if self.leases and not self.stop_flag.is_set():
+            # Leases are re-entrant, so the single-track fallbacks inside can re-acquire them
+            results, claimed = [], []
+            for track in tracks:
+                claim = None if self._already_present(track) else self._claim(track, root_out)
+                (results.append(claim) if claim else claimed.append(track))
+            try:
+                results += self._run_batch(claimed, root_out) if claimed else []
+            finally:
+                for track in claimed:
+                    self.leases.release(track) # No-op for present tracks, which were never leased
+        else:
+            results = self._run_batch(tracks, root_out)
+        for result in results:
+            result["queue_wait"] = result.get("queue_wait", 0.0) + queue_wait
+        return results
+
+    def _run_batch(self, tracks: list, root_out: Path) -> list:
+        if self.stop_flag.is_set():
+            return [{"track": track, "success": False, "skipped": True} for track in tracks]
+
+        present = [self._present_result(track) for track in tracks if self._already_present(track)]
+        if present:
+            tracks = [track for track in tracks if not self._already_present(track)]
+            if not tracks:
+                return present
+            return present + self._download_batch(tracks, root_out)
+
+        if len(tracks) == 1:
+            return [self._download_single_track(tracks[0], root_out)]
+
+        first = tracks[0]
+        out_folder = str(self._playlist_folder(first, root_out))
+        resolved = [self._resolve_query(track) for track in tracks]
+        save_file = None if all(cached for _, cached in resolved) else self._save_file(id(tracks))
+        cmd = self._build_command([query for query, _ in resolved], out_folder, save_file)
+
+        timings = {}
+        self.progress.track_started(id(tracks), f"{first.artist} — {first.title} (+{len(tracks) - 1} more)")
+        if self._throttle(id(tracks), len(tracks)) is None:
+            self.progress.track_finished(id(tracks))
+            return [{"track": track, "success": False, "skipped": True} for track in tracks]
+        started = time.monotonic()
+        try:
+            run_tracked(cmd, DOWNLOAD_TIMEOUT * len(tracks), self.processes,
+                        self._progress_listener(id(tracks)), STALL_TIMEOUT_SECONDS, timings)
+            self._learn_resolutions(tracks, save_file)
+            # One process serves the whole chunk, so its cost is shared out per track
+            duration = (time.monotonic() - started) / len(tracks)
+            spawn = timings.get("spawn", 0.0) / len(tracks)
+            self.progress.track_finished(id(tracks))
+            return [{"track": track, "success": True, "skipped": False, "duration": duration, "error": "",
+                     "spawn": spawn} for track in tracks]
+
+        except Exception as e:
+            self._check_rate_limited(str(getattr(e, "output", None) or ""))
+            self.progress.track_finished(id(tracks))
+            if self.stop_flag.is_set():
+                self._note_interrupted(tracks, started)
+                return [{"track": track, "success": False, "skipped": True} for track in tracks]
+
+            # Tracks whose file arrived are done; only the rest are searched again
+            folder = self._playlist_folder(first, root_out)
+            done, rest = [], []
+            for track in tracks:
+                (done if LibraryIndex.locate(folder, track) else rest).append(track)
+            self._learn_resolutions(done, save_file)
+            duration = (time.monotonic() - started) / len(tracks)
+            spawn = timings.get("spawn", 0.0) / len(tracks)
+            results = [{"track": track, "success": True, "skipped": False, "duration": duration, "error": "",
+                        "spawn": spawn} for track in done]
+            # Bisect the rest so a single bad track doesn't fail its neighbours
+            middle = len(rest) // 2
+            if middle:
+                results += self._download_batch(rest[:middle], root_out)
+            return results + (self._download_batch(rest[middle:], root_out) if rest else [])
+
+
+    def _register_tasks(self, manifest: JobManifest):
+        """
+        Passes the task stream through, recording each track in the manifest.
+        """
+        self.streamed_tracks = 0
+        for track in self.track_tasks:
+            manifest.add(track)
+            self.progress.playlist_added(track.playlist)
+            self.streamed_tracks += 1
+            yield track
+        for playlist in self.progress.input_complete():
+            self._playlist_finished(playlist)
+
+    def _playlist_finished(self, playlist: str):
+        """
+        Called on the coordinator thread once every track of playlist has a final result.
+        """
+        self.progress.set_status(f"Playlist finished: {playlist}")
+        if self.delete_empty:
+            folder = self.run_root_out / sanitize_for_filesystem(playlist)
+            with contextlib.suppress(OSError):
+                if folder.is_dir() and not any(folder.iterdir()):
+                    folder.rmdir()
+
+    def _handle_result(self, item: dict):
+        """
+        Routes one track result on the coordinator thread: transient failures with
+        attempts left go back to the retry scheduler, everything else is final.
+        """
+        track = item["track"]
+        ran = self._ran(item)
+        if self.controller and ran:
+            self.controller.record(item["success"], item.get("timed_out", False))
+        if ran and not item["success"]:
+            self._check_rate_limited(item.get("output") or item.get("error") or "")
+
+        if item["success"]:
+            if ran:
+                self.retries.record_success()
+        elif not item["skipped"] and item.get("error_class") in ("transient", "corrupt"):
+            attempt = self.attempts.get(id(track), 1)
+            if attempt <= MAX_RETRIES:
+                self.metrics.record(item, "retried")
+                delay = self.retries.schedule(track, attempt + 1)
+                self.progress.record_retry()
+                self.progress.set_status(f"Retrying {track.artist} — {track.title} in {delay:.0f}s")
+                return
+
+        item["attempt"] = self.attempts.pop(id(track), 1)
+        self.cache_counted.discard(id(track))
+        self.metrics.record(item, self._outcome(item))
+        self.manifest.record(item)
+        if item["success"] and not item.get("present") and not item.get("elsewhere"):
+            self.library_index.add(sanitize_for_filesystem(track.playlist), track)
+        if not item["success"] and not item["skipped"]:
+            self.failure_log.put(item)
+            if self.query_cache and item.get("rejected") and "|" in item.get("query", ""):
+                self.query_cache.invalidate(track) # The cached match itself is the likely cause
+        if self.progress.record_result(item):
+            self._playlist_finished(track.playlist)
+
+        if not item["skipped"] and not item.get("linked"):
+            self._release_duplicates(item)
+
+    @staticmethod
+    def _ran(item: dict) -> bool:
+        """
+        Whether item comes from a real download rather than a skip, link or lookup.
+        """
+        return not item["skipped"] and not item.get("present") and not item.get("linked") and not item.get("elsewhere")
+
+    def _route_result(self, item: dict):
+        """
+        Hands a successful download to the post-processing stage when it is on;
+        everything else (and the converted result later) goes on to verification.
+        """
+        if self.post_executor and item["success"] and self._ran(item):
+            item["handed_off"] = time.monotonic()
+            self.post_futures[self.post_executor.submit(self._postprocess_track, item, self.run_root_out)] = item
+        else:
+            self._verify_result(item)
+
+    def _verify_result(self, item: dict):
+        """
+        Hands the file of a successful download to the verification pool when it is
+        on; everything else goes straight to _handle_result.
+        """
+        if self.verify_executor and item["success"] and self._ran(item):
+            track = item["track"]
+            folder = self.run_root_out / sanitize_for_filesystem(track.playlist)
+            item["handed_off"] = time.monotonic()
+            try:
+                future = self.verify_executor.submit(verify_track_file, folder, track, item.pop("file", None))
+            except RuntimeError as e: # BrokenProcessPool: a checker process died
+                self.progress.set_status(f"Verification disabled for this run: {e}")
+                self.verify_executor.shutdown(wait=False, cancel_futures=True)
+                self.verify_executor = None
+                self._handle_result(item)
+                return
+            self.verify_futures[future] = item
+        else:
+            self._handle_result(item)
+
+    def _handle_verified(self, item: dict, future):
+        """
+        Deletes a corrupt file and turns its result into a failure that the retry
+        scheduler re-queues; a good file's result is final.
+        """
+        track = item["track"]
+        try:
+            path, problem, item["verify"] = future.result()
+        except Exception as e:
+            # A check that crashed says nothing about the file; keep the download
+            self.progress.set_status(f"Could not check {track.artist} — {track.title}: {e}")
+            path, problem = None, ""
+        if problem:
+            self.progress.set_status(f"Deleted corrupt download {path.name}: {problem}")
+            with contextlib.suppress(OSError):
+                path.unlink() # Or spotdl's "--overwrite skip" would keep it forever
+            item.update(success=False, error_class="corrupt", error=f"Corrupt download: {problem}", output="")
+        self._handle_result(item)
+
+    def _postprocess_track(self, item: dict, root_out: Path) -> dict:
+        """
+        Converts the native file a network worker fetched. Runs on the post-processing pool.
+        """
+        track = item["track"]
+        started = time.monotonic()
+        item["transcode_wait"] = started - item.pop("handed_off")
+        source = self.library_index.locate(self._playlist_folder(track, root_out), track)
+        if source is None:
+            return item # Can't tell which file spotdl wrote; keep it as downloaded
+        if self.stop_flag.is_set():
+            self._note_interrupted([track], started - item["transcode_wait"] - item["duration"])
+            item["skipped"] = True
+            return item
+
+        self.progress.track_started(id(track), f"{track.artist} — {track.title}")
+        self.progress.track_progress(id(track), "converting")
+        try:
+            item["file"] = transcode_audio(source, self.loudnorm, self.processes)
+        except Exception as e:
+            output = str(getattr(e, "output", None) or "")
+            if output:
+                detail = output.splitlines()[-1]
+            elif isinstance(e, subprocess.TimeoutExpired):
+                detail = f"timeout ({TRANSCODE_TIMEOUT}s)"
+            elif isinstance(e, subprocess.CalledProcessError):
+                detail = f"{FFMPEG_CMD} exit code {e.returncode}"
+            else:
+                detail = str(e)
+            item.update(success=False, skipped=self.stop_flag.is_set(), error_class="permanent", output=output,
+                        exit_code=getattr(e, "returncode", None), error=f"Conversion failed: {detail}")
+            with contextlib.suppress(OSError):
+                source.unlink() # So a retry downloads it again instead of finding it present
+        finally:
+            self.progress.track_finished(id(track))
+        item["transcode"] = time.monotonic() - started
+        return item
+
+    @staticmethod
+    def _outcome(item: dict) -> str:
+        if item["skipped"]:
+            return "stopped"
+        if item.get("present"):
+            return "present"
+        if item.get("elsewhere"):
+            return "elsewhere"
+        if item.get("linked"):
+            return "linked" if item["success"] else "failed"
+        return "downloaded" if item["success"] else "failed"
+
+    def _deduplicate(self, tasks):
+        """
+        Passes through the first playlist entry of each unique track; the others
+        are parked on the DuplicateTracker, or linked right away if it's done.
+        """
+        for track in tasks:
+            claim = self.duplicates.claim(track)
+            if claim == "download":
+                yield track
+            elif claim.state != "pending":
+                self._handle_result(self._link_duplicate(track, claim))
+
+    def _release_duplicates(self, item: dict):
+        track = item["track"]
+        if item.get("elsewhere"):
+            # The instance holding the lease links its own duplicates too
+            entry = self.duplicates.entries[track_key(track)]
+            waiters = self.duplicates.resolve(track, False, None, "")
+            entry.state = "elsewhere"
+            for waiter in waiters:
+                self._handle_result(self._link_duplicate(waiter, entry))
+            return
+        source = None
+        if item["success"]:
+            source = self.library_index.locate(self.run_root_out / sanitize_for_filesystem(track.playlist), track)
+        waiters = self.duplicates.resolve(track, item["success"], source, item["error"])
+        if item["success"] and source is None:
+            # Couldn't tell which file spotdl wrote; let every entry download itself
+            self.fallback_tasks.extend(waiters)
+            return
+        entry = self.duplicates.entries[track_key(track)]
+        for waiter in waiters:
+            self._handle_result(self._link_duplicate(waiter, entry))
+
+    def _link_duplicate(self, track: Track, entry: DuplicateEntry) -> dict:
+        result = {"track": track, "success": False, "skipped": False, "linked": True, "duration": 0.0,
+                  "query": self._build_query(track), "error": entry.error}
+        if entry.state == "elsewhere":
+            result.update(success=True, linked=False, elsewhere=True)
+        elif entry.state == "done":
+            try:
+                link_or_copy(entry.source, self._playlist_folder(track, self.run_root_out))
+                result["success"] = True
+            except OSError as e:
+                result["error"] = f"Could not link duplicate from {entry.source}: {e}"
+        return result
+
+    def _check_rate_limited(self, output: str):
+        """
+        Slows the rate limiter down when spotdl's output shows upstream throttling.
+        """
+        if not self.limiter or not RATE_LIMIT_PATTERN.search(output):
+            return
+        rate = self.limiter.penalize()
+        if rate is not None:
+            self.progress.set_status(f"Rate limited upstream; slowing to {rate:.2f} starts/s "
+                                     f"for {RATE_LIMIT_PENALTY_SECONDS}s")
+
+    def _report_concurrency(self, limit: int, reason: str):
+        self.progress.set_concurrency(limit, reason)
+
+    def download_coordinator(self, workers: int, root_out: Path):
+        """
+        The main coordinator function running on a separate thread.
+        It uses the ThreadPoolExecutor to run tasks in parallel.
+        """
+        root_out.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime("%y_%m_%d-%H-%M-%S") + shard_suffix(self.shard)
+        if self.use_leases:
+            stamp += f"_lease-{socket.gethostname()}-{os.getpid()}" # Instances may start in the same second
+        self.log_file_path = root_out.parent / f"ERROR_{stamp}.jsonl" # Store logs one level up
+        self.failed_csv_path = root_out.parent / f"FAILED_{stamp}.csv"
+        self.failure_log = FailureLog(self.log_file_path, self.failed_csv_path)
+        self.stats_file_path = root_out.parent / f"STATS_{stamp}.json"
+        self.metrics = RunMetrics()
+        self.submitted = {} # id(unit) -> monotonic submit time, for the queue wait metric
+        next_export = time.monotonic() + METRICS_EXPORT_INTERVAL_SECONDS
+
+        # Index what's already on disk so existing tracks are skipped without spawning spotdl
+        self.progress.set_status("Indexing existing library...")
+        self.library_index = LibraryIndex.build(root_out)
+        self.query_cache = QueryCache(root_out / QUERY_CACHE_FILE_NAME)
+        self.resolve_dir = tempfile.mkdtemp(prefix="spdl-resolved-")
+
+        self.progress.set_status(f"Running {workers} concurrent downloads...")
+
+        # Only this instance's partition of the input; the manifest then holds just that shard
+        if self.shard:
+            index, count = self.shard
+            self.track_tasks = (track for track in self.track_tasks if shard_of(track, count) == index)
+        self.leases = LeaseManager(root_out) if self.use_leases else None
+
+        # Persist every job so an interrupted run can be resumed
+        self.manifest = JobManifest(manifest_path(root_out, self.shard), resume=self.resuming)
+        registered = self._register_tasks(self.manifest)
+
+        # One network download per unique track; other playlist entries get linked copies
+        self.run_root_out = root_out
+        self.duplicates = DuplicateTracker()
+        self.fallback_tasks = deque()
+        scheduler = SCHEDULERS.get(self.scheduler, schedule_fifo)
+        tasks = self._deduplicate(scheduler(registered))
+
+        # In auto mode the pool is sized for the ceiling and the in-flight window is the real limit
+        controller = self.controller = AdaptiveConcurrency(workers) if self.auto_concurrency else None
+        pool_size = AUTO_CONCURRENCY_MAX if controller else workers
+
+        # Use ThreadPoolExecutor for concurrent execution, or one event loop for the asyncio engine
+        if self.engine == "Asyncio":
+            self.executor = AsyncioEngine(max_workers=pool_size)
+        else:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=pool_size)
+
+        # Conversion gets its own CPU-sized pool; each job runs one ffmpeg process
+        self.post_futures = {}
+        if self.postprocess:
+            self.post_executor = concurrent.futures.ThreadPoolExecutor(max_workers=POSTPROCESS_WORKERS)
+        self.verify_futures = {}
+        if self.verify:
+            self.verify_executor = verification_pool()
+
+        # Warm helpers outlive a single run so their spotdl clients stay warm
+        if self.engine == "Warm workers" and (self.warm_pool is None or self.warm_pool.size != pool_size
+                                              or self.warm_pool.native != self.postprocess):
+            if self.warm_pool:
+                self.warm_pool.close()
+            self.warm_pool = WarmWorkerPool(pool_size, registry=self.processes, native=self.postprocess)
+        if self.warm_pool:
+            self.warm_pool.limit = controller.limit if controller else pool_size
+
+        # Batched mode hands chunks of queries to one spotdl process
+        if self.engine == "Batched":
+            units, download = iter_batches(tasks, self.batch_size), self._download_batch
+        elif self.engine == "Asyncio":
+            units, download = tasks, self._download_single_track_async
+        else:
+            units, download = tasks, self._download_single_track
+
+        # Feed the executor from the task stream through a bounded in-flight window.
+        # Due retries go first; waiting retries sit in the scheduler, not in a worker slot.
+        max_in_flight = workers * IN_FLIGHT_PER_WORKER
+        if controller:
+            self._report_concurrency(controller.limit, "starting")
+        self.retries = RetryScheduler()
+        self.attempts = {} # id(track) -> attempt number, only for tracks being retried
+        self.cache_counted = set() # id(track) of unfinished tracks whose cache lookup was counted
+        # Paces spotdl starts across all workers; present and linked tracks never spend a token
+        self.limiter = TokenBucket(self.rate_limit, self.rate_burst) if self.rate_limit > 0 else None
+        exhausted = False
+        while not self.stop_flag.is_set():
+            if controller:
+                reason = controller.evaluate()
+                if reason:
+                    self._report_concurrency(controller.limit, reason)
+                max_in_flight = controller.limit
+                if self.warm_pool:
+                    self.warm_pool.limit = controller.limit
+
+            self.query_cache.maybe_flush()
+            if METRICS_PROMETHEUS_FILE and time.monotonic() >= next_export:
+                self._export_prometheus()
+                next_export = time.monotonic() + METRICS_EXPORT_INTERVAL_SECONDS
+
+            # A full conversion or verification backlog holds back new downloads instead of piling up files
+            while (len(self.active_futures) < max_in_flight and len(self.post_futures) < POSTPROCESS_QUEUE_SIZE
+                   and len(self.verify_futures) < VERIFY_QUEUE_SIZE):
+                retry = self.retries.pop_ready(drain=exhausted)
+                if retry:
+                    track, self.attempts[id(track)] = retry
+                    unit = [track] if self.engine == "Batched" else track
+                elif self.fallback_tasks:
+                    track = self.fallback_tasks.popleft()
+                    unit = [track] if self.engine == "Batched" else track
+                elif exhausted:
+                    break
+                else:
+                    unit = next(units, None)
+                    if unit is None:
+                        exhausted = True
+                        self.progress.set_total(self.streamed_tracks)
+                        continue
+                self.submitted[id(unit)] = time.monotonic()
+                self.active_futures.add(self.executor.submit(download, unit, root_out))
+
+            if not self.active_futures and not self.post_futures and not self.verify_futures:
+                if exhausted and not self.retries and not self.fallback_tasks:
+                    break
+                # Only backed-off retries left; sleep until the next one is due
+                self.stop_flag.wait(min(self.retries.next_due_in(), 0.5))
+                continue
+
+            done, _ = concurrent.futures.wait(self.active_futures | self.post_futures.keys() | self.verify_futures.keys(),
+                                              timeout=0.2, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if self.stop_flag.is_set():
+                    break # Killed downloads stay pending in the manifest for Resume
+                # Download results may still need converting, converted ones verifying; verified ones are final
+                verified = self.verify_futures.pop(future, None)
+                if verified:
+                    self._handle_verified(verified, future)
+                    continue
+                converted = self.post_futures.pop(future, None) is not None
+                self.active_futures.discard(future)
+                try:
+                    result = future.result()
+                    for item in (result if isinstance(result, list) else [result]):
+                        if converted:
+                            self._verify_result(item)
+                        else:
+                            self._route_result(item)
+                except concurrent.futures.CancelledError:
+                    continue
+                except Exception as e:
+                    # Should not happen if _download_single_track handles exceptions, but good practice
+                    print(f"FATAL THREAD ERROR: Future failed: {e}")
+                    self.progress.record_error()
+
+        # Wait for any currently running tasks to finish (optional, but cleaner shutdown)
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.executor = None # Clear executor reference
+        self.active_futures.clear()
+        if self.post_executor:
+            self.post_executor.shutdown(wait=True, cancel_futures=True)
+            self.post_executor = None
+            for future, item in self.post_futures.items():
+                if future.cancelled():
+                    # Never converted; drop the native file so Resume fetches the track again
+                    self._note_interrupted([item["track"]], item["handed_off"] - item["duration"])
+            self.post_futures.clear()
+        if self.verify_executor:
+            self.verify_executor.shutdown(wait=True, cancel_futures=True)
+            self.verify_executor = None
+            for future, item in self.verify_futures.items():
+                if future.cancelled() or (future.exception() is None and future.result()[1]):
+                    # Never checked, or bad: drop the file so Resume fetches the track again.
+                    # A check that failed says nothing about the file, so that one is kept
+                    self._note_interrupted([item["track"]], item["handed_off"] - item["duration"])
+            self.verify_futures.clear()
+        if self.stop_flag.is_set():
+            self._remove_partial_downloads(root_out)
+
+        # Register the tracks a stop left unread so Resume still sees the whole job
+        for _ in registered:
+            pass
+        self.manifest.close()
+        self.failure_log.close()
+        self.query_cache.close()
+        self.query_cache = None
+        shutil.rmtree(self.resolve_dir, ignore_errors=True)
+        self.resolve_dir = None
+        if self.leases:
+            self.leases.close()
+        try:
+            self.metrics.write_json(self.stats_file_path)
+        except OSError as e:
+            print(f"Error writing run stats: {e}")
+        if METRICS_PROMETHEUS_FILE:
+            self._export_prometheus()
+        self.library_index.refresh()
+        self.library_index.save()
+
+        # Signal completion to the main thread
+        self.progress.finish()
+
+
+    def _note_interrupted(self, tracks: list, started: float):
+        # started is monotonic; file mtimes are wall-clock
+        started_at = time.time() - (time.monotonic() - started)
+        self.interrupted.extend((track, started_at) for track in tracks)
+
+    def _remove_partial_downloads(self, root_out: Path):
+        """
+        Deletes what killed downloads left behind: fragments in every folder this run
+        wrote to, plus output files that were (re)written after their track started.
+        With leases, other instances download into the same folders, so only the
+        fragments of this run's interrupted tracks are removed.
+        """
+        if self.use_leases:
+            by_folder = {}
+            for track, _ in self.interrupted:
+                by_folder.setdefault(self._playlist_folder(track, root_out), []).append(track)
+            removed = sum(cleanup_partial_files([folder], tracks) for folder, tracks in by_folder.items())
+        else:
+            removed = cleanup_partial_files(self.touched_folders)
+        for track, started in self.interrupted:
+            path = self.library_index.locate(self._playlist_folder(track, root_out), track)
+            with contextlib.suppress(OSError):
+                if path and path.stat().st_mtime >= started:
+                    path.unlink()
+                    removed += 1
+        if removed:
+            print(f"Removed {removed} partial file(s) left by stopped downloads.")
+        self.interrupted.clear()
+
+    def _export_prometheus(self):
+        try:
+            self.metrics.write_prometheus(Path(METRICS_PROMETHEUS_FILE))
+        except OSError as e:
+            print(f"Error writing Prometheus metrics: {e}")
+
+def _instance_files(folder: Path, prefix: str, suffix: str) -> list:
+    """
+    Per-instance output files of sharded or leased runs in folder.
+    """
+    files = set(folder.glob(f"{prefix}_*_shard*.{suffix}")) | set(folder.glob(f"{prefix}_*_lease-*.{suffix}"))
+    return sorted(files)
+
+def merge_shard_outputs(folder: Path) -> list:
+    """
+    Combines the per-shard (or per-leased-instance) failure logs, failed-track CSVs
+    and stats summaries in folder into ERROR_merged.jsonl, FAILED_merged.csv and STATS_merged.json.
+    Returns the paths written.
+    """
+    written = []
+    logs = _instance_files(folder, "ERROR", "jsonl")
+    if logs:
+        target = folder / "ERROR_merged.jsonl"
+        with open(target, "w", encoding="utf-8") as out:
+            for log in logs:
+                with open(log, "r", encoding="utf-8") as f:
+                    shutil.copyfileobj(f, out)
+        written.append(target)
+
+    failed = _instance_files(folder, "FAILED", "csv")
+    if failed:
+        target = folder / "FAILED_merged.csv"
+        with open(target, "w", encoding="utf-8", newline="") as out:
+            writer = csv.writer(out)
+            writer.writerow(CSV_FIELDS)
+            for path in failed:
+                with open(path, "r", encoding="utf-8", newline="") as f:
+                    rows = csv.reader(f)
+                    next(rows, None) # Header
+                    writer.writerows(rows)
+        written.append(target)
+
+    stats = _instance_files(folder, "STATS", "json")
+    if stats:
+        summaries = []
+        for path in stats:
+            try:
+                summaries.append(json.loads(path.read_text(encoding="utf-8")))
+            except (OSError, ValueError) as e:
+                print(f"Skipping {path}: {e}")
+        target = folder / "STATS_merged.json"
+        RunMetrics._write_atomic(target, json.dumps(RunMetrics.merge_summaries(summaries), indent=2))
+        written.append(target)
+    return written
+
+# ------------------ Command Line ------------------
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="SpDL.py",
+        description="Download a Spotify library with spotdl. Run without arguments to open the GUI.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--csv", help="CSV/TXT export (TuneMyMusic/Exportify columns, or one query per line)")
+    source.add_argument("--link", action="append", help="Spotify playlist, album, artist or track link (repeatable)")
+    source.add_argument("--resume", action="store_true", help="Re-queue the unfinished tracks of the last job in the output folder")
+    parser.add_argument("-o", "--output", required=True, help="Output folder")
+    parser.add_argument("--subfolder", default=DEFAULT_OUTPUT_FOLDER_NAME, help="Sub-folder created inside the output folder")
+    parser.add_argument("-w", "--workers", default=str(DEFAULT_CONCURRENT_WORKERS), help='Concurrent downloads, or "auto"')
+    parser.add_argument("--engine", choices=ENGINES, default=ENGINES[0])
+    parser.add_argument("--rate", type=float, default=RATE_LIMIT_PER_SECOND,
+                        help=f"Max spotdl starts per second across all workers, 0 = unlimited (default {RATE_LIMIT_PER_SECOND})")
+    parser.add_argument("--burst", type=int, default=RATE_LIMIT_BURST,
+                        help=f"Starts allowed back to back before --rate applies (default {RATE_LIMIT_BURST})")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--order", choices=list(SCHEDULER_OPTIONS), default="fifo",
+                        help="Download order: input order, round robin across playlists, or whole playlists smallest first")
+    source.add_argument("--merge", action="store_true", help="Combine the per-shard logs and stats in the output folder, then exit")
+    parser.add_argument("--shard", help='Only download partition I of N, e.g. "2/4" (by track, so duplicates stay together)')
+    parser.add_argument("--lease", action="store_true", help="Claim tracks with lock files in the output folder so instances never fetch the same file")
+    parser.add_argument("--postprocess", action="store_true",
+                        help=f"Download native {NATIVE_FORMAT} and convert to {OUTPUT_FORMAT} on a separate pool of "
+                             f"{POSTPROCESS_WORKERS} ffmpeg processes")
+    parser.add_argument("--loudnorm", action="store_true", help="Normalize loudness while converting (implies --postprocess)")
+    parser.add_argument("--delete-empty", action="store_true", help="Delete empty playlist folders afterwards")
+    parser.add_argument("--no-verify", action="store_true",
+                        help="Don't check downloaded files for truncation/corruption (corrupt ones are deleted and re-queued)")
+    source.add_argument("--verify-library", action="store_true",
+                        help=f"Check every audio file in the output folder on {VERIFY_WORKERS} processes, then exit")
+    parser.add_argument("--delete-corrupt", action="store_true",
+                        help="With --verify-library: delete corrupt files so the next run with the same CSV/link fetches them again")
+    parser.add_argument("-q", "--quiet", action="store_true", help="No progress output")
+    return parser
+
+def report_progress(session: DownloadSession, done: threading.Event):
+    """
+    Writes progress to stderr until done is set: one updating line on a terminal,
+    a line every 10 seconds otherwise.
+    """
+    interactive = sys.stderr.isatty()
+    interval = 0.5 if interactive else 10
+    last_version = -1
+    while not done.wait(interval):
+        snap = session.progress.snapshot()
+        if snap["version"] == last_version:
+            continue
+        last_version = snap["version"]
+        pct = snap["completed"] / snap["total"] * 100 if snap["total"] else 0.0
+        line = (f"{snap['completed']}/{snap['total']} ({pct:.1f}%) errors {snap['errors']} "
+                f"present {snap['present']} active {len(snap['active'])} | {snap['status']}")
+        if snap["concurrency"]:
+            line += f" | {snap['concurrency']}"
+        if interactive:
+            sys.stderr.write("\r" + line[:shutil.get_terminal_size().columns - 1].ljust(40))
+        else:
+            sys.stderr.write(line + "\n")
+        sys.stderr.flush()
+    if interactive:
+        sys.stderr.write("\n")
+
+def verify_library_cli(root_out: Path, delete: bool, quiet: bool) -> int:
+    """
+    --verify-library: prints each corrupt file and a summary. Exit code 1 if any were found.
+    """
+    if not root_out.is_dir():
+        print(f"No library found in {root_out}", file=sys.stderr)
+        return 2
+    extensions = AUDIO_EXTENSIONS
+    if not is_tool(FFMPEG_CMD):
+        # Without ffmpeg only MP3s can be checked; other files are left alone
+        print(f"Warning: {FFMPEG_CMD} was not found on PATH; only MP3 files are checked.", file=sys.stderr)
+        extensions = {".mp3"}
+    checked, corrupt, unchecked = 0, 0, 0
+    for path, problem, error in verify_library(root_out, delete, extensions=extensions):
+        checked += 1
+        if problem:
+            corrupt += 1
+            print(f"{'Deleted' if delete else 'Corrupt'}: {path}: {problem}")
+        elif error:
+            unchecked += 1
+            print(f"Could not check: {path}: {error}")
+        if not quiet and checked % 500 == 0:
+            print(f"Checked {checked} files...", file=sys.stderr)
+    print(f"Checked {checked} files: {corrupt} corrupt, {unchecked} could not be checked", file=sys.stderr)
+    return 1 if corrupt else 0
+
+def main(argv=None) -> int:
+    args = build_arg_parser().parse_args(argv)
+    session = DownloadSession()
+    session.engine = args.engine
+    session.batch_size = args.batch_size if args.batch_size > 0 else DEFAULT_BATCH_SIZE
+    session.auto_concurrency = args.workers.strip().lower() == "auto"
+    try:
+        workers = DEFAULT_CONCURRENT_WORKERS if session.auto_concurrency else int(args.workers)
+    except ValueError:
+        print(f"Invalid --workers value: {args.workers}", file=sys.stderr)
+        return 2
+    workers = workers if workers > 0 else DEFAULT_CONCURRENT_WORKERS
+    root_out = Path(args.output) / sanitize_for_filesystem(args.subfolder)
+
+    if args.merge:
+        written = merge_shard_outputs(root_out.parent)
+        for path in written:
+            print(f"Wrote {path}", file=sys.stderr)
+        return 0 if written else 2
+    if args.verify_library:
+        return verify_library_cli(root_out, args.delete_corrupt, args.quiet)
+    if args.shard:
+        try:
+            session.shard = parse_shard(args.shard)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+    session.use_leases = args.lease
+    session.rate_limit, session.rate_burst = max(args.rate, 0.0), max(args.burst, 1)
+    session.postprocess = args.postprocess or args.loudnorm
+    session.loudnorm = args.loudnorm
+    session.scheduler = SCHEDULER_OPTIONS[args.order]
+    session.delete_empty = args.delete_empty
+    session.verify = not args.no_verify
+
+    if not is_tool(SPOTDL_CMD):
+        print(f"Warning: {SPOTDL_CMD} was not found on PATH.", file=sys.stderr)
+    if session.postprocess and not is_tool(FFMPEG_CMD):
+        print(f"Warning: {FFMPEG_CMD} was not found on PATH; conversions will fail.", file=sys.stderr)
+
+    if args.resume:
+        previous = manifest_path(root_out, session.shard)
+        if not previous.exists():
+            print(f"No previous job found in {root_out}", file=sys.stderr)
+            return 2
+        tasks, total = JobManifest.load_unfinished(previous), JobManifest.count_unfinished(previous)
+        session.resuming = True
+    elif args.csv:
+        if not os.path.exists(args.csv):
+            print(f"Invalid CSV/TXT path: {args.csv}", file=sys.stderr)
+            return 2
+        tasks, total = session.load_csv(args.csv), count_csv_rows(args.csv)
+    else:
+        links = split_links(" ".join(args.link))
+        tasks, total = session._resolve_links(links), len(links)
+    if total == 0:
+        print("No tracks found to download.", file=sys.stderr)
+        return 0
+    if session.shard and not args.resume:
+        total = max(total // session.shard[1], 1) # Estimate; corrected once the input is read
+
+    session.prepare(tasks, total)
+    done = threading.Event()
+    reporter = None
+    if not args.quiet:
+        reporter = threading.Thread(target=report_progress, args=(session, done), daemon=True)
+        reporter.start()
+    # Waits on an Event: a join() interrupted by Ctrl+C can leave the thread looking
+    # finished (CPython gh-90882), and the process would exit before cleanup ran
+    finished = threading.Event()
+    def coordinate():
+        try:
+            session.download_coordinator(workers, root_out)
+        finally:
+            finished.set()
+    coordinator = threading.Thread(target=coordinate)
+    coordinator.start()
+    interrupted = False
+    try:
+        while not finished.wait(0.5):
+            pass
+    except KeyboardInterrupt:
+        interrupted = True
+        session.request_stop()
+        finished.wait()
+    done.set()
+    if reporter:
+        reporter.join()
+
+    if args.delete_empty:
+        delete_empty_folders(root_out)
+    snap = session.progress.snapshot()
+    print(f"Completed: {snap['completed']} / {snap['total']}, already present: {snap['present']}, "
+          f"linked duplicates: {snap['linked']}, errors: {snap['errors']}", file=sys.stderr)
+    if session.metrics:
+        cache = session.metrics.query_cache
+        print(f"Query cache: {cache['hits']} hits, {cache['misses']} misses", file=sys.stderr)
+    if session.failure_log and session.failure_log.count:
+        print(f"Failed tracks: {session.failed_csv_path}\nDetails: {session.log_file_path}", file=sys.stderr)
+    if interrupted:
+        return 130
+    return 1 if snap["errors"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+"""
+SPOTDL GUI v1.9.0 — Deluxe Spotify Downloader GUI
+
+Author: Minxify_ig
+Website: https://minxie.likesyou.org
+Github: https://github.com/Minxify/Spotify-downloader-GUI
+
+The window. Imported by SpDL.py only when the GUI is opened, so scripted use
+never pays for the toolkit; the download logic lives in spdl_core.py.
+"""
+
+import os
+import threading
+from pathlib import Path
+from datetime import datetime
+
+import customtkinter as ctk
+from tkinter import filedialog, messagebox, ttk
+import webbrowser
+
+from spdl_core import (
+    DEFAULT_OUTPUT_FOLDER_NAME, SPOTDL_CMD, FFMPEG_CMD, DEFAULT_CONCURRENT_WORKERS, DEFAULT_BATCH_SIZE,
+    RATE_LIMIT_PER_SECOND, ENGINES, SCHEDULERS, ETA_UPDATE_INTERVAL_SECONDS, UI_MIN_TICK_MS, UI_MAX_TICK_MS,
+    UI_MAX_ACTIVE_ROWS, UI_MAX_PLAYLIST_ROWS, THROUGHPUT_WINDOW_SECONDS, DownloadSession, JobManifest, count_csv_rows,
+    delete_empty_folders, format_eta, is_tool, manifest_path, sanitize_for_filesystem, split_links,
+)
+
+# ------------------ GUI App ------------------
+class SpotDLGUI(DownloadSession):
+    def __init__(self):
+        super().__init__()
+        self.executor_thread = None
+
+        # Counters mirrored from the latest progress snapshot
+        self.total_tracks = 0
+        self.completed_tracks = 0
+        self.error_count = 0
+        self.present_count = 0
+        self.retry_count = 0
+        self.in_flight_progress = 0.0
+        self.linked_count = 0
+
+        # UI polling
+        self.rendered_version = -1
+        self.poll_interval_ms = UI_MIN_TICK_MS
+
+        # ETA Management (NEW)
+        self.download_start_time = None
+        self.last_eta_update_time = datetime.min # Initialize to minimum possible time
+
+        # ---------------- Setup UI ----------------
+        ctk.set_appearance_mode("dark")
+        ctk.set_default_color_theme("dark-blue")
+        self.root = ctk.CTk()
+        self.root.title("SPOTDL GUI v2.0.0 (Concurrent)")
+        self.root.geometry("900x1140") # Taller to fit the active downloads, playlists and stats panels
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        # Input type dropdown
+        self.input_type_var = ctk.StringVar(value="CSV/TXT")
+        self.input_types = ["CSV/TXT", "Spotify Playlist Link"]
+        self.input_dropdown = ctk.CTkComboBox(self.root, values=self.input_types, variable=self.input_type_var, command=self.update_input_mode)
+        self.input_dropdown.pack(pady=(10,5))
+
+        # CSV input
+        self.csv_frame = ctk.CTkFrame(self.root)
+        self.csv_frame.pack(fill="x", padx=10)
+        self.csv_path_var = ctk.StringVar()
+        self.csv_entry = ctk.CTkEntry(self.csv_frame, textvariable=self.csv_path_var, width=600)
+        self.csv_entry.pack(side="left", padx=(5,5), pady=5)
+        self.csv_btn = ctk.CTkButton(self.csv_frame, text="Select CSV/TXT", command=self.select_csv)
+        self.csv_btn.pack(side="left", padx=5, pady=5)
+
+        # Playlist link input
+        self.playlist_frame = ctk.CTkFrame(self.root)
+        self.playlist_frame.pack(fill="x", padx=10)
+        self.playlist_frame.pack_forget()
+        self.playlist_var = ctk.StringVar()
+        self.playlist_entry = ctk.CTkEntry(self.playlist_frame, textvariable=self.playlist_var, width=600)
+        self.playlist_entry.pack(side="left", padx=(5,5), pady=5)
+
+        # Output folder
+        out_frame = ctk.CTkFrame(self.root)
+        out_frame.pack(fill="x", padx=10, pady=(5,5))
+        self.dest_var = ctk.StringVar()
+        self.out_entry = ctk.CTkEntry(out_frame, textvariable=self.dest_var, width=600)
+        self.out_entry.pack(side="left", padx=(5,5), pady=5)
+        self.out_btn = ctk.CTkButton(out_frame, text="Select Folder", command=self.select_out)
+        self.out_btn.pack(side="left", padx=5)
+
+        # Concurrency and Subfolder Frame
+        option_frame = ctk.CTkFrame(self.root)
+        option_frame.pack(fill="x", padx=10, pady=(0, 5))
+
+        # Subfolder name
+        self.subfolder_var = ctk.StringVar(value=DEFAULT_OUTPUT_FOLDER_NAME)
+        subfolder_label = ctk.CTkLabel(option_frame, text="Output Subfolder:")
+        subfolder_label.pack(side="left", padx=(5, 5), pady=5)
+        self.subfolder_entry = ctk.CTkEntry(option_frame, textvariable=self.subfolder_var, width=200)
+        self.subfolder_entry.pack(side="left", padx=(0, 20), pady=5)
+
+        # Concurrent Downloads Option
+        self.concurrent_var = ctk.StringVar(value=str(DEFAULT_CONCURRENT_WORKERS)) # A number or "auto"
+        concurrent_label = ctk.CTkLabel(option_frame, text="Concurrent Downloads:")
+        concurrent_label.pack(side="left", padx=(20, 5), pady=5)
+        self.concurrent_entry = ctk.CTkEntry(option_frame, textvariable=self.concurrent_var, width=50)
+        self.concurrent_entry.pack(side="left", padx=(0, 5), pady=5)
+
+        # Engine and batch size
+        self.engine_var = ctk.StringVar(value=ENGINES[0])
+        engine_label = ctk.CTkLabel(option_frame, text="Engine:")
+        engine_label.pack(side="left", padx=(20, 5), pady=5)
+        self.engine_dropdown = ctk.CTkComboBox(option_frame, values=ENGINES, variable=self.engine_var, width=110)
+        self.engine_dropdown.pack(side="left", padx=(0, 5), pady=5)
+        self.batch_size_var = ctk.IntVar(value=DEFAULT_BATCH_SIZE)
+        batch_label = ctk.CTkLabel(option_frame, text="Batch:")
+        batch_label.pack(side="left", padx=(10, 5), pady=5)
+        self.batch_size_entry = ctk.CTkEntry(option_frame, textvariable=self.batch_size_var, width=50)
+        self.batch_size_entry.pack(side="left", padx=(0, 5), pady=5)
+        self.rate_var = ctk.StringVar(value=str(RATE_LIMIT_PER_SECOND)) # spotdl starts per second, 0 = unlimited
+        rate_label = ctk.CTkLabel(option_frame, text="Rate/s:")
+        rate_label.pack(side="left", padx=(10, 5), pady=5)
+        self.rate_entry = ctk.CTkEntry(option_frame, textvariable=self.rate_var, width=45)
+        self.rate_entry.pack(side="left", padx=(0, 5), pady=5)
+
+        # Options
+        self.delete_empty_var = ctk.BooleanVar(value=True)
+        self.delete_empty_chk = ctk.CTkCheckBox(self.root, text="Delete empty playlist folders after download", variable=self.delete_empty_var)
+        self.delete_empty_chk.pack(pady=(0,5))
+        post_frame = ctk.CTkFrame(self.root)
+        post_frame.pack(pady=(0,5))
+        self.postprocess_var = ctk.BooleanVar(value=False)
+        self.postprocess_chk = ctk.CTkCheckBox(post_frame, text="Convert on a separate CPU pool", variable=self.postprocess_var)
+        self.postprocess_chk.pack(side="left", padx=10)
+        self.loudnorm_var = ctk.BooleanVar(value=False)
+        self.loudnorm_chk = ctk.CTkCheckBox(post_frame, text="Normalize loudness", variable=self.loudnorm_var)
+        self.loudnorm_chk.pack(side="left", padx=10)
+        self.verify_var = ctk.BooleanVar(value=True)
+        self.verify_chk = ctk.CTkCheckBox(post_frame, text="Verify files", variable=self.verify_var)
+        self.verify_chk.pack(side="left", padx=10)
+        self.scheduler_var = ctk.StringVar(value=next(iter(SCHEDULERS)))
+        scheduler_label = ctk.CTkLabel(post_frame, text="Order:")
+        scheduler_label.pack(side="left", padx=(10, 5))
+        self.scheduler_dropdown = ctk.CTkComboBox(post_frame, values=list(SCHEDULERS), variable=self.scheduler_var, width=190)
+        self.scheduler_dropdown.pack(side="left", padx=(0, 10))
+
+        # Buttons
+        btn_frame = ctk.CTkFrame(self.root)
+        btn_frame.pack(pady=(5,10))
+        self.start_btn = ctk.CTkButton(btn_frame, text="Start Download", command=self.start_downloads)
+        self.start_btn.pack(side="left", padx=5)
+        self.resume_btn = ctk.CTkButton(btn_frame, text="Resume", command=self.resume_downloads)
+        self.resume_btn.pack(side="left", padx=5)
+        self.stop_btn = ctk.CTkButton(btn_frame, text="Stop", command=self.stop_downloads, state="disabled")
+        self.stop_btn.pack(side="left", padx=5)
+        self.retry_failed_btn = ctk.CTkButton(btn_frame, text="Retry failed", command=self.retry_failed, state="disabled")
+        self.retry_failed_btn.pack(side="left", padx=5)
+
+        # Progress info
+        self.progress_var = ctk.DoubleVar()
+        self.progressbar = ctk.CTkProgressBar(self.root, variable=self.progress_var)
+        self.progressbar.pack(fill="x", padx=10, pady=(5,2))
+        self.progress_label = ctk.CTkLabel(self.root, text="0 / 0 (0.000%)")
+        self.progress_label.pack(pady=(0,5))
+
+        # ETA Label (NEW)
+        self.eta_label = ctk.CTkLabel(self.root, text="ETA: Ready")
+        self.eta_label.pack(pady=(0,5))
+
+        self.status_label = ctk.CTkLabel(self.root, text="Status: Ready")
+        self.status_label.pack(pady=(0,5))
+
+        # Active downloads panel
+        self.active_label = ctk.CTkLabel(self.root, text="Active downloads: 0")
+        self.active_label.pack(pady=(0,2))
+        self.active_box = ctk.CTkTextbox(self.root, height=160)
+        self.active_box.pack(fill="x", padx=10, pady=(0,5))
+        self.active_box.configure(state="disabled")
+
+        # Per-playlist progress
+        self.playlists_label = ctk.CTkLabel(self.root, text="Playlists: 0 / 0 finished")
+        self.playlists_label.pack(pady=(0,2))
+        self.playlists_box = ctk.CTkTextbox(self.root, height=120)
+        self.playlists_box.pack(fill="x", padx=10, pady=(0,5))
+        self.playlists_box.configure(state="disabled")
+
+        # Run statistics
+        self.stats_label = ctk.CTkLabel(self.root, text="", justify="left", anchor="w")
+        self.stats_label.pack(fill="x", padx=10, pady=(0,5))
+
+        # Footer links
+        footer_frame = ctk.CTkFrame(self.root)
+        footer_frame.pack(side="bottom", pady=5)
+        self.website_label = ctk.CTkLabel(footer_frame, text="Hi there!", text_color="cyan", cursor="hand2")
+        self.website_label.pack(side="left", padx=5)
+        self.website_label.bind("<Button-1>", lambda e: webbrowser.open("https://minxie.likesyou.org"))
+        self.github_label = ctk.CTkLabel(footer_frame, text="Github project", text_color="cyan", cursor="hand2")
+        self.github_label.pack(side="left", padx=5)
+        self.github_label.bind("<Button-1>", lambda e: webbrowser.open("https://github.com/Minxify/Spotify-downloader-GUI"))
+
+        # Cursor bindings
+        self.root.bind_all("<Enter>", self.update_cursor)
+
+        # Dependency check
+        self.check_dependencies()
+
+        # Start GUI thread
+        self.root.mainloop()
+    # ---------------- UI Methods ----------------
+    def update_input_mode(self, value=None):
+        if self.input_type_var.get() == "CSV/TXT":
+            self.csv_frame.pack(fill="x", padx=10)
+            self.playlist_frame.pack_forget()
+        else:
+            self.playlist_frame.pack(fill="x", padx=10)
+            self.csv_frame.pack_forget()
+
+    def select_csv(self):
+        path = filedialog.askopenfilename(filetypes=[("CSV/TXT Files", "*.csv *.txt")])
+        if path:
+            self.csv_path_var.set(path)
+
+    def select_out(self):
+        path = filedialog.askdirectory()
+        if path:
+            self.dest_var.set(path)
+
+    def update_cursor(self, event=None):
+        widget = self.root.winfo_containing(event.x_root, event.y_root)
+        if widget:
+            cls_name = widget.winfo_class()
+            if cls_name in ("CTkEntry", "Entry"):
+                widget.configure(cursor="xterm")
+            elif cls_name in ("CTkButton", "Button"):
+                widget.configure(cursor="hand2")
+            else:
+                widget.configure(cursor="arrow")
+
+    # ---------------- Dependency Check ----------------
+    def check_dependencies(self):
+        # NOTE: Using a placeholder check here since mutagen import is handled outside of runtime
+        missing = []
+        if not is_tool(SPOTDL_CMD):
+            missing.append("spotdl")
+        if not is_tool(FFMPEG_CMD):
+            missing.append("ffmpeg")
+        if missing:
+            messagebox.showinfo("Dependencies missing",
+                                      f"The following dependencies are required:\n{', '.join(missing)}\nPlease install them manually.")
+
+    def install_dependency(self, name):
+        # Removed automatic installation logic as it often requires elevated privileges (sudo/pipx)
+        # and can be unreliable in a general context. Informing the user is safer.
+        pass
+
+    # ---------------- Download Logic ----------------
+
+    def _root_out(self) -> Path:
+        return Path(self.dest_var.get()) / sanitize_for_filesystem(self.subfolder_var.get())
+
+    def resume_downloads(self):
+        self.start_downloads(resume=True)
+
+    def retry_failed(self):
+        """
+        Starts a new run from the failed-tracks CSV of the previous run.
+        """
+        if not self.failed_csv_path or not self.failed_csv_path.exists():
+            messagebox.showinfo("Info", "The last run has no failed tracks to retry.")
+            return
+        self.input_type_var.set("CSV/TXT")
+        self.update_input_mode()
+        self.csv_path_var.set(str(self.failed_csv_path))
+        self.start_downloads()
+
+    def start_downloads(self, resume: bool = False):
+        self.auto_concurrency = self.concurrent_var.get().strip().lower() == "auto"
+        try:
+            workers = DEFAULT_CONCURRENT_WORKERS if self.auto_concurrency else int(self.concurrent_var.get())
+            if workers <= 0:
+                 workers = DEFAULT_CONCURRENT_WORKERS
+                 self.concurrent_var.set(str(workers))
+        except Exception:
+            workers = DEFAULT_CONCURRENT_WORKERS
+            self.concurrent_var.set(str(workers))
+
+        try:
+            self.batch_size = self.batch_size_var.get()
+            if not isinstance(self.batch_size, int) or self.batch_size <= 0:
+                self.batch_size = DEFAULT_BATCH_SIZE
+                self.batch_size_var.set(self.batch_size)
+        except Exception:
+            self.batch_size = DEFAULT_BATCH_SIZE
+            self.batch_size_var.set(self.batch_size)
+
+        self.engine = self.engine_var.get() if self.engine_var.get() in ENGINES else ENGINES[0]
+        try:
+            self.rate_limit = max(float(self.rate_var.get()), 0.0)
+        except ValueError:
+            self.rate_limit = RATE_LIMIT_PER_SECOND
+            self.rate_var.set(str(self.rate_limit))
+        self.loudnorm = self.loudnorm_var.get()
+        self.scheduler = self.scheduler_var.get() if self.scheduler_var.get() in SCHEDULERS else next(iter(SCHEDULERS))
+        self.delete_empty = self.delete_empty_var.get()
+        self.verify = self.verify_var.get()
+        self.postprocess = self.postprocess_var.get() or self.loudnorm # Normalizing needs the conversion stage
+
+        self.completed_tracks = 0
+        self.error_count = 0
+        self.present_count = 0
+        self.linked_count = 0
+        self.retry_count = 0
+        self.in_flight_progress = 0.0
+
+        # ETA Initialization (NEW)
+        self.download_start_time = datetime.now()
+        self.last_eta_update_time = datetime.now()
+
+
+        # Tasks are streamed to the coordinator; only a fast count happens up front
+        if resume:
+            previous = manifest_path(self._root_out())
+            if not previous.exists():
+                messagebox.showerror("Error", f"No previous job found in {previous.parent}")
+                return
+            # Only the pending and failed rows of the previous run are re-queued
+            tasks = JobManifest.load_unfinished(previous)
+            self.total_tracks = JobManifest.count_unfinished(previous)
+        elif self.input_type_var.get() == "CSV/TXT":
+            path = self.csv_path_var.get()
+            if not os.path.exists(path):
+                messagebox.showerror("Error", "Invalid CSV/TXT path")
+                return
+            tasks = self.load_csv(path)
+            self.total_tracks = count_csv_rows(path)
+        else:
+            links = split_links(self.playlist_var.get())
+            if not links:
+                messagebox.showerror("Error", "Enter one or more Spotify playlist, album or artist links")
+                return
+            # Links are expanded into individual tracks on the coordinator thread
+            tasks = self._resolve_links(links)
+            self.total_tracks = len(links)
+
+        if self.total_tracks == 0:
+            messagebox.showinfo("Info", "No tracks found to download.")
+            return
+
+        self.resuming = resume
+        self.prepare(tasks, self.total_tracks)
+        self.progress.set_status(f"Initializing {workers} workers.")
+        self.rendered_version = -1
+        self.poll_interval_ms = UI_MIN_TICK_MS
+        self.progress_var.set(0)
+        self.eta_label.configure(text="ETA: Calculating...")
+
+        # Start the background execution thread
+        self.executor_thread = threading.Thread(target=self.download_coordinator, args=(workers, self._root_out()))
+        self.executor_thread.start()
+
+        # Start the UI update poller
+        self.root.after(100, self._check_download_status)
+
+        self.start_btn.configure(state="disabled")
+        self.resume_btn.configure(state="disabled")
+        self.retry_failed_btn.configure(state="disabled")
+        self.stop_btn.configure(state="normal")
+
+
+    def stop_downloads(self):
+        self.request_stop()
+        self.eta_label.configure(text="ETA: Stopping...")
+        self.stop_btn.configure(state="disabled")
+
+    def _update_eta(self):
+        """
+        Calculates and updates the Estimated Time of Arrival (ETA).
+        """
+        if self.completed_tracks == 0 or self.stop_flag.is_set() or self.total_tracks == 0:
+            self.eta_label.configure(text="ETA: Calculating...")
+            return
+
+        current_time = datetime.now()
+        # Time elapsed in seconds
+        time_elapsed = (current_time - self.download_start_time).total_seconds()
+
+        # Avoid division by zero, though completed_tracks > 0 is checked above
+        if self.completed_tracks > 0 and time_elapsed > 0:
+            # Partly downloaded tracks count for the share of work they have done
+            done = self.completed_tracks + self.in_flight_progress
+            avg_time_per_track = time_elapsed / done
+
+            # Calculate remaining tracks and remaining time
+            remaining_tracks = max(self.total_tracks - done, 0)
+            remaining_seconds = avg_time_per_track * remaining_tracks
+
+            # Format and display
+            eta_str = format_eta(remaining_seconds)
+            self.eta_label.configure(text=f"ETA: {eta_str}")
+        else:
+            self.eta_label.configure(text="ETA: N/A")
+
+        self.last_eta_update_time = current_time # Update tracking timestamp
+
+
+    def _render_progress(self, snap: dict):
+        """
+        Draws one snapshot of the run. Called at most once per UI tick.
+        """
+        self.total_tracks = snap["total"]
+        self.completed_tracks = snap["completed"]
+        self.error_count = snap["errors"]
+        self.present_count = snap["present"]
+        self.linked_count = snap["linked"]
+        self.retry_count = snap["retries"]
+        self.in_flight_progress = snap["in_flight"]
+
+        pct = (self.completed_tracks / self.total_tracks) * 100 if self.total_tracks else 0.0
+        self.progress_var.set(pct / 100)
+        self.progress_label.configure(text=f"{self.completed_tracks} / {self.total_tracks} ({pct:.3f}%)")
+
+        status = (f"Status: {snap['status']} Errors: {self.error_count}, Already present: {self.present_count}, "
+                  f"Retries: {self.retry_count}")
+        if snap["concurrency"]:
+            status += f" | {snap['concurrency']}"
+        self.status_label.configure(text=status)
+
+        active = snap["active"]
+        self.active_label.configure(text=f"Active downloads: {len(active)}")
+        lines = active[:UI_MAX_ACTIVE_ROWS]
+        if len(active) > UI_MAX_ACTIVE_ROWS:
+            lines.append(f"... and {len(active) - UI_MAX_ACTIVE_ROWS} more")
+        self.active_box.configure(state="normal")
+        self.active_box.delete("1.0", "end")
+        self.active_box.insert("1.0", "\n".join(lines))
+        self.active_box.configure(state="disabled")
+
+        playlists = snap["playlists"]
+        self.playlists_label.configure(text=f"Playlists: {snap['playlists_finished']} / {snap['playlists_total']} finished")
+        if snap["playlists_total"] > UI_MAX_PLAYLIST_ROWS:
+            playlists = playlists + [f"... and {snap['playlists_total'] - UI_MAX_PLAYLIST_ROWS} more"]
+        self.playlists_box.configure(state="normal")
+        self.playlists_box.delete("1.0", "end")
+        self.playlists_box.insert("1.0", "\n".join(playlists))
+        self.playlists_box.configure(state="disabled")
+
+        if self.metrics:
+            self.stats_label.configure(text=self._format_stats(self.metrics.summary()))
+
+    def _format_stats(self, stats: dict) -> str:
+        latency = stats["latency_seconds"]
+        def percentiles(phase):
+            p = latency[phase]
+            return f"{p['p50']:.1f} / {p['p95']:.1f} / {p['p99']:.1f}s"
+        errors = ", ".join(f"{k}: {v}" for k, v in sorted(stats["error_classes"].items())) or "none"
+        return (f"Throughput: {stats['throughput_tracks_per_second']:.2f} tracks/s "
+                f"(last {THROUGHPUT_WINDOW_SECONDS}s), {stats['overall_tracks_per_second']:.2f} overall\n"
+                f"Runtime p50/p95/p99: {percentiles('runtime')}   Queue wait: {percentiles('queue_wait')}   "
+                f"Spawn: {percentiles('spawn')}\n"
+                f"Errors by class: {errors}")
+
+    def _check_download_status(self):
+        """
+        This function runs periodically on the main UI thread. It renders the
+        latest progress snapshot when something changed and backs off while idle.
+        """
+        snap = self.progress.snapshot()
+
+        if snap["version"] != self.rendered_version:
+            self._render_progress(snap)
+            self.rendered_version = snap["version"]
+            self.poll_interval_ms = UI_MIN_TICK_MS
+        else:
+            self.poll_interval_ms = min(self.poll_interval_ms * 2, UI_MAX_TICK_MS)
+
+        if snap["finished"]:
+            self._final_cleanup()
+            return
+
+        # Check if 10 seconds have passed since the last ETA update
+        time_since_last_update = (datetime.now() - self.last_eta_update_time).total_seconds()
+        if time_since_last_update >= ETA_UPDATE_INTERVAL_SECONDS:
+            self._update_eta()
+
+        self.root.after(self.poll_interval_ms, self._check_download_status)
+
+
+    def _final_cleanup(self):
+        """
+        Final steps after all downloads (or stop signal) have been processed.
+        Runs on the main UI thread.
+        """
+        self.status_label.configure(text="Status: Cleaning up...")
+        self.eta_label.configure(text="ETA: Complete")
+
+        # Delete empty folders; finished playlists were already swept as they completed
+        if self.delete_empty_var.get():
+            delete_empty_folders(self._root_out())
+
+        # All Done popup
+        end_time = datetime.now()
+        failed = self.failure_log.count if self.failure_log else 0
+        cache = self.metrics.query_cache if self.metrics else {"hits": 0, "misses": 0}
+        messagebox.showinfo(
+            "All Done!",
+            f"Downloads finished or stopped.\nTotal completed: {self.completed_tracks} / {self.total_tracks}\nAlready present: {self.present_count}\nLinked duplicates: {self.linked_count}\nErrors recorded: {self.error_count}"
+            + f"\nQuery cache: {cache['hits']} hits, {cache['misses']} misses"
+            + (f"\n\nFailed tracks: {self.failed_csv_path}\nDetails: {self.log_file_path}" if failed else "")
+        )
+
+        # Reset UI
+        self.start_btn.configure(state="normal")
+        self.resume_btn.configure(state="normal")
+        self.retry_failed_btn.configure(state="normal" if failed else "disabled")
+        self.stop_btn.configure(state="disabled")
+        self.active_label.configure(text="Active downloads: 0")
+        self.active_box.configure(state="normal")
+        self.active_box.delete("1.0", "end")
+        self.active_box.configure(state="disabled")
+        self.status_label.configure(text="Status: Ready")
+
+
+    # ---------------- Close ----------------
+    def on_close(self):
+        if messagebox.askokcancel("Quit", "Exit SPOTDL GUI?"):
+            # Kills running downloads and shuts the executor down without waiting
+            self.close()
+            self.root.destroy()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+SPOTDL GUI warm worker — a long-lived helper process for the "Warm workers" engine.
+
+Imports spotdl as a library once, keeps its Spotify/YouTube clients (and their
+HTTP sessions) alive and serves one download job per line over stdin/stdout:
+
+    job:   {"id": 1, "query": "...", "output": "/music/Playlist"}
+    reply: {"id": 1, "success": true, "error": "", "path": "/music/Playlist/Artist - Title.mp3"}
+
+Any module exposing a spotdl-compatible ``Spotdl`` class (``search(queries)``,
+``download(song)`` and a ``downloader.settings`` dict) can stand in for spotdl
+via ``--module``, which is how tests and benchmarks run without the network.
+"""
+
+import os
+import sys
+import json
+import argparse
+import importlib
+from pathlib import Path
+
+OUTPUT_TEMPLATE = "{artists} - {title}.{output-ext}"
+
+
+def build_client(module_name: str, audio_format: str, overwrite: str, bitrate: str = None):
+    module = importlib.import_module(module_name)
+    try:
+        config = importlib.import_module(f"{module_name}.utils.config").DEFAULT_CONFIG
+    except (ImportError, AttributeError):
+        config = {}
+
+    settings = {
+        "format": audio_format,
+        "overwrite": overwrite,
+        "log_level": "ERROR",
+        "simple_tui": True,
+    }
+    if bitrate:
+        settings["bitrate"] = bitrate # "disable" keeps the source stream as is
+
+    return module.Spotdl(
+        client_id=config.get("client_id", ""),
+        client_secret=config.get("client_secret", ""),
+        downloader_settings=settings,
+    )
+
+
+def run_job(client, job: dict) -> dict:
+    reply = {"id": job.get("id"), "success": False, "error": "", "path": "", "url": "", "download_url": ""}
+    client.downloader.settings["output"] = str(Path(job["output"]) / OUTPUT_TEMPLATE)
+
+    songs = client.search([job["query"]])
+    if not songs:
+        reply["error"] = f"No results found for: {job['query']}"
+        return reply
+
+    paths = []
+    for song in songs:
+        _, path = client.download(song)
+        if path is None:
+            reply["error"] = f"Download failed for: {getattr(song, 'display_name', job['query'])}"
+            return reply
+        paths.append(str(path))
+
+    reply["success"] = True
+    reply["path"] = paths[0] if paths else ""
+    if len(songs) == 1:
+        # What the query resolved to, so the next run can skip the search
+        reply["url"] = getattr(songs[0], "url", "") or ""
+        reply["download_url"] = getattr(songs[0], "download_url", "") or ""
+    return reply
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SPOTDL GUI warm worker")
+    parser.add_argument("--module", default="spotdl")
+    parser.add_argument("--format", default="mp3")
+    parser.add_argument("--overwrite", default="skip")
+    parser.add_argument("--bitrate")
+    args = parser.parse_args()
+
+    # Keep a private handle on the real stdout for the protocol and send anything
+    # spotdl (or its progress bars) prints to stderr instead.
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8", buffering=1)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    def send(message: dict):
+        protocol.write(json.dumps(message) + "\n")
+        protocol.flush()
+
+    try:
+        client = build_client(args.module, args.format, args.overwrite, args.bitrate)
+    except Exception as e:
+        send({"ready": False, "error": f"{type(e).__name__}: {e}"})
+        return 1
+    send({"ready": True})
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        job = json.loads(line)
+        try:
+            reply = run_job(client, job)
+        except Exception as e:
+            reply = {"id": job.get("id"), "success": False, "error": f"{type(e).__name__}: {e}", "path": ""}
+        send(reply)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
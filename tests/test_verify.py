@@ -0,0 +1,119 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import spdl_core
+from spdl_core import VerificationError, mp3_duration, verify_audio_file, verify_library
+
+FRAME_SECONDS = 1152 / 44100
+MISSING_TOOL = "/nonexistent/ffmpeg"
+
+# ------------------ MP3 builders ------------------
+
+def frame(pad: int = 0) -> bytes:
+    # MPEG-1 layer III, 128 kbps, 44.1 kHz, joint stereo: 417 bytes (+1 padded)
+    return bytes([0xFF, 0xFB, 0x90 | (pad << 1), 0x64]) + bytes(417 + pad - 4)
+
+def xing_frame(frame_count: int) -> bytes:
+    data = bytearray(frame())
+    data[36:48] = b"Xing" + (1).to_bytes(4, "big") + frame_count.to_bytes(4, "big")
+    return bytes(data)
+
+def id3v2() -> bytes:
+    return b"ID3\x03\x00\x00\x00\x00\x01\x00" + bytes(128)
+
+def id3v1() -> bytes:
+    return b"TAG" + bytes(125)
+
+def ape(items: bytes = bytes(40)) -> bytes:
+    def block(flags: int) -> bytes:
+        return (b"APETAGEX" + (2000).to_bytes(4, "little") + (len(items) + 32).to_bytes(4, "little")
+                + (1).to_bytes(4, "little") + flags.to_bytes(4, "little") + bytes(8))
+    return block(0xA0000000) + items + block(0x80000000)
+
+def mp3(frames: int = 40) -> bytes:
+    return xing_frame(frames) + b"".join(frame(i % 2) for i in range(frames))
+
+class Mp3DurationTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, data: bytes, name: str = "song.mp3") -> Path:
+        path = Path(self.tmp.name) / name
+        path.write_bytes(data)
+        return path
+
+    def test_complete_file_with_tags(self):
+        path = self.write(id3v2() + mp3() + ape() + id3v1())
+        self.assertAlmostEqual(mp3_duration(path), 40 * FRAME_SECONDS, places=3)
+        self.assertEqual(verify_audio_file(path), "")
+
+    def test_truncated_mid_frame(self):
+        path = self.write(id3v2() + mp3()[:-200])
+        with self.assertRaisesRegex(ValueError, "truncated"):
+            mp3_duration(path)
+        self.assertIn("truncated", verify_audio_file(path))
+
+    def test_fewer_frames_than_xing_header(self):
+        path = self.write(xing_frame(40) + b"".join(frame() for _ in range(20)) + id3v1())
+        with self.assertRaisesRegex(ValueError, "20 of 40 frames"):
+            mp3_duration(path)
+
+    def test_no_frames(self):
+        path = self.write(id3v2() + b"not an mp3" * 100)
+        with self.assertRaisesRegex(ValueError, "no MP3 audio frames"):
+            mp3_duration(path)
+
+    def test_empty_file(self):
+        self.assertEqual(verify_audio_file(self.write(b"")), "empty file")
+
+    def test_shorter_than_expected(self):
+        path = self.write(mp3())
+        self.assertEqual(verify_audio_file(path, expected=1.0), "")
+        self.assertIn("too short", verify_audio_file(path, expected=240.0))
+
+class CheckErrorTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = Path(self.tmp.name)
+        self.flac = self.root / "song.flac"
+        self.flac.write_bytes(b"fLaC" + bytes(1000))
+
+    def test_missing_tool_is_not_corruption(self):
+        with mock.patch.object(spdl_core, "FFMPEG_CMD", MISSING_TOOL):
+            with self.assertRaises(VerificationError):
+                verify_audio_file(self.flac)
+
+    def test_timeout_is_not_corruption(self):
+        timeout = subprocess.TimeoutExpired("ffmpeg", spdl_core.VERIFY_TIMEOUT)
+        with mock.patch.object(spdl_core.subprocess, "run", side_effect=timeout):
+            with self.assertRaisesRegex(VerificationError, "timed out"):
+                verify_audio_file(self.flac)
+
+    def test_unreadable_file_is_not_corruption(self):
+        with self.assertRaises(VerificationError):
+            verify_audio_file(self.root / "missing.mp3")
+
+    def test_library_keeps_unchecked_files(self):
+        corrupt = self.root / "broken.mp3"
+        corrupt.write_bytes(mp3()[:-200])
+        # The verification pool is spawned, so it reads the command from the environment
+        with mock.patch.dict(os.environ, {"SPDL_FFMPEG_CMD": MISSING_TOOL}), \
+                mock.patch.object(spdl_core, "FFMPEG_CMD", MISSING_TOOL):
+            results = {path.name: (problem, error) for path, problem, error in verify_library(self.root, delete=True, workers=1)}
+        self.assertEqual(results["song.flac"][0], "")
+        self.assertTrue(results["song.flac"][1])
+        self.assertIn("truncated", results["broken.mp3"][0])
+        self.assertTrue(self.flac.exists())
+        self.assertFalse(corrupt.exists())
+
+if __name__ == "__main__":
+    unittest.main()